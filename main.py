@@ -1,8 +1,15 @@
-from dash import Dash, dcc, html, Input, Output
-import plotly.graph_objects as go
-import pandas as pd
+import logging
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
 
-from utils.indicator import CustomTradeIndicator
+from utils.cache import ResultCache
+from utils.datasets import DatasetStore
+from utils.executor import CoalescingExecutor, Superseded, compute_shape_index, init_worker, record_stats
+from utils.metrics import metrics, profile, register_endpoint
+from utils.render import render
+from utils.viewport import downsample_ohlc, relayout_range, visible_range
 
 sources = {
     'file (long wait)': {
@@ -13,71 +20,100 @@ sources = {
     }
 }
 background_color = '#050505'
+log = logging.getLogger(__name__)
 
-app = Dash(__name__)
 
-app.layout = html.Div([
-    html.H4('Pythonic TradingView Indicators'),
-    html.Div(className='six columns', children=[
-        dcc.Checklist(
-                id='toggle-activate-indicators',
-                options=[{'label': 'Indicator', 'value': 'indicator'}],
-                value=[False]
-            ),
-        dcc.RadioItems(
-                id='select-source',
-                value='web',
-                options=[*sources.keys()],
-                inline=True,
-            ),
-    ]),
-    html.Div(className='six columns', children=[
-        html.Span(children='Input candle range:'),
-        dcc.Input(
-            id='candle_range',
-            type='number',
-            placeholder='Candle Range',
-            value=15,
-            min=5,
-            max=100,
-            step=1,
-        ),
-        dcc.Checklist(
-            id='toggle-activate-extras',
-            options=[
-                {'label': 'Show PDH/PDL', 'value': 'showPD'},
-                {'label': 'Show Bearish BOS Lines', 'value': 'showBearishBOS'},
-                {'label': 'Show Bullish BOS Lines', 'value': 'showBullishBOS'},
-            ],
-            value=['showPD', 'showBearishBOS', 'showBullishBOS'],
-            inline=True,
-        ),
-    ]),
-    dcc.Graph(
-        id="graph",
-        # config={'displayModeBar': True, 'scrollZoom': True}
-    ),
-])
-
-
-@app.callback(
-    Output("graph", "figure"),
-    Input("toggle-activate-indicators", "value"),
-    Input("select-source", "value"),
-    Input("candle_range", "value"),
-    Input("toggle-activate-extras", "value"),
-)
-def display_candlestick(indicators, source, candle_range, extras):
-    df = pd.read_csv(sources[source]['link'])
-    df.columns = df.columns.str.lower()
-    df.columns = [column.split('.')[-1] for column in df.columns]
+class Charts:
+    """Datasets, caches and background executor, that app callbacks build figures with."""
+    def __init__(self, sources: dict):
+        self.sources = sources
+        # each source is parsed once and then memory-mapped from data/.cache, until the source changes
+        self.datasets = DatasetStore(sources)
+        # computed shapes of (dataset, candle_range, extras), so toggling inputs back doesn't recompute
+        self.results_cache = ResultCache(max_entries=32, max_bytes=256 * 2 ** 20)
+        metrics.collector('results_cache', self.results_cache.stats, counters=('hits', 'misses', 'evictions'))
+        self._executor = None
+        self._executor_lock = Lock()
+
+    @property
+    def executor(self) -> CoalescingExecutor:
+        """Indicator runs in worker processes, identical requests in flight are computed once.
+         Pool is created on first use, so every forked server worker gets its own one."""
+        with self._executor_lock:
+            if self._executor is None:
+                pool = ProcessPoolExecutor(initializer=init_worker, initargs=(self.sources,))
+                # indicator counters are counted in workers and recorded here, where /metrics is served
+                self._executor = CoalescingExecutor(pool, self.results_cache, on_result=record_stats)
+            return self._executor
+
+    def _replace_executor(self, executor: CoalescingExecutor):
+        """Drops executor, whose worker process died, so the next request creates a new pool."""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _shape_index(self, key, session_id, source: str, candle_range: int, extras):
+        """Computes shapes index in worker process. If a worker has died (killed, crashed),
+         the broken pool is replaced and computation is retried once."""
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return executor.result(key, session_id, compute_shape_index, source, candle_range, extras)
+            except BrokenProcessPool:
+                log.warning('worker process died, pool is replaced')
+                metrics.incr('executor_broken')
+                self._replace_executor(executor)
+                if attempt:
+                    raise
+
+    def figure(self, indicators, source, candle_range, extras, x_range=None, session_id=None):
+        """Returns candlestick figure of bars in x_range of relayout_range() with indicator shapes over them."""
+        # cleared, fractional or out of range input: whole bars, the same default as CustomTradeIndicator has
+        candle_range = int(candle_range or 0)
+        if candle_range < 1:
+            candle_range = 15
+        stages = {}
+        with metrics.timer('load', stages):
+            df = self.datasets.get(source)
+        # only bars in zoomed x-range are sent, merged to about screen width
+        start, stop = visible_range(x_range, df['timestamp'])
+        with metrics.timer('figure', stages):
+            fig = candlestick_figure(df, start, stop)
+        if 'indicator' in indicators:
+            key = (df.fingerprint, candle_range, tuple(sorted(extras)))
+            with metrics.timer('indicator', stages):
+                # also a cached answer supersedes older computations of session
+                self.executor.mark_latest(session_id, key)
+                shape_index = self.results_cache.get(key)
+                if shape_index is None:
+                    try:
+                        shape_index = self._shape_index(key, session_id, df.name, candle_range, tuple(extras))
+                    except Superseded:
+                        from dash.exceptions import PreventUpdate
+                        # user has already changed inputs, the newer callback will answer
+                        raise PreventUpdate
+                result = shape_index.query(start, stop)
+            with metrics.timer('render', stages):
+                # few packed scatter traces instead of a layout shape per element
+                render(fig, result, df['date'], mode='traces')
+            metrics.incr('shapes_emitted', len(result))
+        log.info('figure of %s (bars %d...%d of %d): %s', source, start, stop, len(df),
+                 ', '.join(f'{stage} {seconds * 1000:.1f} ms' for stage, seconds in stages.items()))
+        return fig
+
+
+def candlestick_figure(df, start, stop):
+    import plotly.graph_objects as go
+
+    bars, open_, high, low, close = downsample_ohlc(df['open'], df['high'], df['low'], df['close'], start, stop)
     fig = go.Figure(
         go.Candlestick(
-            x=df['date'],
-            open=df[f'open'],
-            high=df[f'high'],
-            low=df[f'low'],
-            close=df[f'close'],
+            x=df['date'][bars],
+            open=open_,
+            high=high,
+            low=low,
+            close=close,
         )
     )
 
@@ -85,14 +121,18 @@ def display_candlestick(indicators, source, candle_range, extras):
         # dragmode='pan',
         plot_bgcolor=background_color,
         paper_bgcolor=background_color,
-        height=800
+        height=800,
+        # keep user zoom, when other inputs change
+        uirevision=df.name,
     )
     fig.update_xaxes(
         mirror=True,
         ticks='outside',
         showline=True,
         linecolor='black',
-        gridcolor='#252525'
+        gridcolor='#252525',
+        # range slider would show only the sent viewport, not the whole history
+        rangeslider_visible=False,
     )
     fig.update_yaxes(
         mirror=True,
@@ -102,11 +142,103 @@ def display_candlestick(indicators, source, candle_range, extras):
         gridcolor='#252525',
         side='right'
     )
-    indicator = CustomTradeIndicator(fig, df)
-    if 'indicator' in indicators:
-        indicator.draw_indicator(candle_range, extras)
-
     return fig
 
 
-app.run_server(debug=True)
+def create_app(sources: dict = sources, preload: bool = True):
+    """Builds Dash app. Dash and plotly are imported here, not on import of this module.
+     With preload datasets are parsed and memory-mapped right away, so WSGI server, that loads app
+     before forking workers (gunicorn --preload), gives them warm dataset pages shared copy-on-write."""
+    from dash import Dash, ctx, dcc, html, Input, Output, State
+
+    charts = Charts(sources)
+    if preload:
+        # sources are parsed and memory-mapped now, instead of on the first request
+        charts.datasets.preload()
+
+    app = Dash(__name__)
+    app.charts = charts
+    # Prometheus scrape endpoint with stage timings, indicator counters and cache stats
+    register_endpoint(app.server)
+
+    layout = html.Div([
+        html.H4('Pythonic TradingView Indicators'),
+        html.Div(className='six columns', children=[
+            dcc.Checklist(
+                    id='toggle-activate-indicators',
+                    options=[{'label': 'Indicator', 'value': 'indicator'}],
+                    value=[False]
+                ),
+            dcc.RadioItems(
+                    id='select-source',
+                    value='web',
+                    options=[*sources.keys()],
+                    inline=True,
+                ),
+        ]),
+        html.Div(className='six columns', children=[
+            html.Span(children='Input candle range:'),
+            dcc.Input(
+                id='candle_range',
+                type='number',
+                placeholder='Candle Range',
+                value=15,
+                min=5,
+                max=100,
+                step=1,
+            ),
+            dcc.Checklist(
+                id='toggle-activate-extras',
+                options=[
+                    {'label': 'Show PDH/PDL', 'value': 'showPD'},
+                    {'label': 'Show Bearish BOS Lines', 'value': 'showBearishBOS'},
+                    {'label': 'Show Bullish BOS Lines', 'value': 'showBullishBOS'},
+                ],
+                value=['showPD', 'showBearishBOS', 'showBullishBOS'],
+                inline=True,
+            ),
+        ]),
+        dcc.Graph(
+            id="graph",
+            # config={'displayModeBar': True, 'scrollZoom': True}
+        ),
+    ])
+
+    def serve_layout():
+        """Layout per page load, with id of browser session to drop its stale requests."""
+        return html.Div([dcc.Store(id='session-id', data=uuid.uuid4().hex), dcc.Store(id='viewport'), layout])
+
+    app.layout = serve_layout
+
+    @app.callback(
+        Output("graph", "figure"),
+        Output("viewport", "data"),
+        Input("toggle-activate-indicators", "value"),
+        Input("select-source", "value"),
+        Input("candle_range", "value"),
+        Input("toggle-activate-extras", "value"),
+        Input("graph", "relayoutData"),
+        State("session-id", "data"),
+        State("viewport", "data"),
+    )
+    def display_candlestick(indicators, source, candle_range, extras, relayout_data, session_id, viewport):
+        # relayoutData has only keys changed by the last event, so x-range is kept per session.
+        # figure of other source is autoranged by its uirevision
+        x_range = viewport['range'] if viewport and viewport['source'] == source else None
+        if ctx.triggered_id == 'graph':
+            x_range = relayout_range(relayout_data, x_range)
+        with profile('display_candlestick'):
+            figure = charts.figure(indicators, source, candle_range, extras, x_range, session_id)
+        return figure, {'source': source, 'range': x_range}
+
+    return app
+
+
+def create_server():
+    """Returns WSGI application: gunicorn --preload --workers 2 --threads 8 'main:create_server()'"""
+    return create_app().server
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    create_app().run_server(debug=True)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import builtins
+
+SOURCE = np.array([3., 1., 4., 1., 5., 9., 2., 6., 5., 3.])
+
+
+@pytest.mark.parametrize('periods', [0, 1, 3, -2, 9, 10, 12, -10, -12])
+def test_shift_matches_pandas(periods):
+    expected = pd.Series(SOURCE).shift(periods).to_numpy()
+    np.testing.assert_array_equal(builtins.shift(SOURCE, periods), expected)
+
+
+def test_shift_fill_and_short_series():
+    np.testing.assert_array_equal(builtins.shift(np.arange(5.), 7, fill=0), np.zeros(5))
+    np.testing.assert_array_equal(builtins.shift([], 1), [])
+    np.testing.assert_array_equal(builtins.shift([2.], 1), [np.nan])
+    np.testing.assert_array_equal(builtins.shift([2.], -1), [np.nan])
+
+
+@pytest.mark.parametrize('length', [1, 2, 3, 4, 10, 15])
+@pytest.mark.parametrize('min_periods', [None, 1, 2])
+def test_rolling_extremum_matches_pandas(length, min_periods):
+    if min_periods is not None and min_periods > length:
+        pytest.skip('pandas requires min_periods <= length')
+    rolling = pd.Series(SOURCE).rolling(length, min_periods=min_periods)
+    np.testing.assert_array_equal(builtins.rolling_min(SOURCE, length, min_periods), rolling.min().to_numpy())
+    np.testing.assert_array_equal(builtins.rolling_max(SOURCE, length, min_periods), rolling.max().to_numpy())
+
+
+@pytest.mark.parametrize('function', [builtins.rolling_min, builtins.rolling_max])
+def test_rolling_extremum_short_series(function):
+    assert len(function([], 3)) == 0
+    np.testing.assert_array_equal(function([2.], 3), [np.nan])
+    np.testing.assert_array_equal(function([2.], 3, min_periods=1), [2.])
+    with pytest.raises(ValueError):
+        function(SOURCE, 0)
+
+
+def test_rolling_mean_and_std():
+    np.testing.assert_allclose(builtins.sma(SOURCE, 3)[2:], [8 / 3, 2, 10 / 3, 5, 16 / 3, 17 / 3, 13 / 3, 14 / 3])
+    assert np.isnan(builtins.sma(SOURCE, 3)[:2]).all()
+    np.testing.assert_allclose(builtins.rolling_std(SOURCE, 4)[3:],
+                               [np.std(SOURCE[start - 3:start + 1]) for start in range(3, len(SOURCE))])
+
+
+def test_ema_starts_from_first_value():
+    expected = [SOURCE[0]]
+    for value in SOURCE[1:]:
+        expected.append(0.5 * value + 0.5 * expected[-1])
+    np.testing.assert_allclose(builtins.ema(SOURCE, 3), expected)
+    assert len(builtins.ema([], 3)) == 0
+    np.testing.assert_array_equal(builtins.ema([2.], 3), [2.])
+
+
+def test_rma_starts_from_sma():
+    expected = [np.nan, np.nan, SOURCE[:3].mean()]
+    for value in SOURCE[3:]:
+        expected.append((value + 2 * expected[-1]) / 3)
+    np.testing.assert_allclose(builtins.rma(SOURCE, 3), expected)
+    np.testing.assert_array_equal(builtins.rma([1., 2.], 3), [np.nan, np.nan])
+    assert len(builtins.rma([], 3)) == 0
+
+
+def test_true_range_and_atr():
+    high = np.array([10., 12., 11., 15.])
+    low = np.array([8., 9., 7., 13.])
+    close = np.array([9., 11., 8., 14.])
+    tr = builtins.true_range(high, low, close)
+    np.testing.assert_array_equal(tr, [2., 3., 4., 7.])
+    expected = [np.nan, 2.5, (4 + 2.5) / 2, (7 + 3.25) / 2]
+    np.testing.assert_allclose(builtins.atr(high, low, close, 2), expected)
+    np.testing.assert_array_equal(builtins.true_range([5.], [3.], [4.]), [2.])
+
+
+def test_crossover_and_crossunder():
+    x = np.array([1., 3., 2., 2., 4., 1.])
+    y = np.array([2., 2., 2., 3., 3., 3.])
+    np.testing.assert_array_equal(builtins.crossover(x, y), [False, True, False, False, True, False])
+    np.testing.assert_array_equal(builtins.crossunder(x, y), [False, False, False, False, False, True])
+    # strict: touching the level is not a cross
+    np.testing.assert_array_equal(builtins.crossover(x, 2), [False, True, False, False, False, False])
+    np.testing.assert_array_equal(builtins.crossunder(x, 2), [False, False, False, False, False, True])
+    assert len(builtins.crossover([], 1)) == 0
+    np.testing.assert_array_equal(builtins.crossover([5.], 1), [False])
+
+
+def test_valuewhen():
+    condition = np.array([False, True, False, True, True, False])
+    source = np.arange(6.) * 10
+    np.testing.assert_array_equal(builtins.valuewhen(condition, source), [np.nan, 10, 10, 30, 40, 40])
+    np.testing.assert_array_equal(builtins.valuewhen(condition, source, 1), [np.nan, np.nan, np.nan, 10, 30, 30])
+    np.testing.assert_array_equal(builtins.valuewhen(condition, source, 5), [np.nan] * 6)
+    assert len(builtins.valuewhen([], [])) == 0
+    np.testing.assert_array_equal(builtins.valuewhen([True], [7.]), [7.])
+
+
+def test_barssince():
+    condition = np.array([False, True, False, False, True, False])
+    np.testing.assert_array_equal(builtins.barssince(condition), [np.nan, 0, 1, 2, 0, 1])
+    assert len(builtins.barssince([])) == 0
+    np.testing.assert_array_equal(builtins.barssince([False]), [np.nan])
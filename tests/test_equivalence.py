@@ -0,0 +1,9 @@
+import os
+
+from utils.equivalence import run_equivalence
+
+DATASET = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'ohlcv.csv')
+
+
+def test_all_engines_match_reference():
+    assert run_equivalence(cases=50, seed=0, dataset=DATASET) == []
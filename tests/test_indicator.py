@@ -0,0 +1,26 @@
+import os
+
+import pandas as pd
+import pytest
+
+from utils.datasets import normalize_columns
+from utils.equivalence import loop_engine, run_equivalence
+from utils.indicator import CustomTradeIndicator
+
+DATASET = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'ohlcv.csv')
+
+
+@pytest.mark.parametrize('skip_oldest_box', [True, False])
+def test_skip_oldest_box_matches_reference(skip_oldest_box):
+    assert run_equivalence(cases=30, seed=1, engines={'loop': loop_engine}, dataset=DATASET,
+                           skip_oldest_box=skip_oldest_box) == []
+
+
+def test_skip_oldest_box_changes_mitigation():
+    data = normalize_columns(pd.read_csv(DATASET))
+    data = {column: data[column].to_numpy() for column in ('date', 'open', 'high', 'low', 'close')}
+    kept, mitigated = (CustomTradeIndicator(None, data, skip_oldest_box).compute(15, [])
+                       for skip_oldest_box in (True, False))
+    # with the quirk the oldest box of each side is never mitigated, so more boxes stay drawn
+    assert len(kept) > len(mitigated)
+    assert kept.x0.min() < mitigated.x0.min()
@@ -0,0 +1,91 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from utils import kernel
+from utils.benchmark import random_walk_ohlcv
+from utils.store import TABLES, ResultStore
+
+EXTRAS = ('showPD', 'showBearishBOS', 'showBullishBOS')
+FIELDS = ('x0', 'x1', 'y0', 'y1', 'kind', 'style', 'candle_colour_mode', 'bos_candle')
+
+
+def assert_same(result, expected):
+    for name in FIELDS:
+        np.testing.assert_array_equal(getattr(result, name), getattr(expected, name), err_msg=name)
+
+
+def head(data, bars):
+    return {column: values[:bars] for column, values in data.items()}
+
+
+@pytest.fixture
+def data():
+    return random_walk_ohlcv(4000, seed=7)
+
+
+def test_appended_bars_are_computed_alone(tmp_path, data):
+    store = ResultStore(str(tmp_path))
+    store.update('X', head(data, 3000), 15, EXTRAS, fingerprint='a')
+    stats = {}
+    result = store.update('X', data, 15, EXTRAS, fingerprint='b', stats=stats)
+    assert stats['bars_processed'] == 1000
+    assert_same(result, kernel.compute(data, 15, EXTRAS))
+    # unchanged source is read from disk
+    result = store.update('X', data, 15, EXTRAS, fingerprint='b', stats=stats)
+    assert stats['bars_processed'] == 0
+    assert_same(result, kernel.compute(data, 15, EXTRAS))
+
+
+def test_rewritten_past_bar_rebuilds(tmp_path, data):
+    store = ResultStore(str(tmp_path))
+    store.update('X', head(data, 3000), 15, EXTRAS, fingerprint='a')
+    corrected = {column: values.copy() for column, values in data.items()}
+    corrected['close'][1234] *= 1.05
+    stats = {}
+    result = store.update('X', corrected, 15, EXTRAS, fingerprint='b', stats=stats)
+    assert stats['bars_processed'] == 4000
+    assert_same(result, kernel.compute(corrected, 15, EXTRAS))
+
+
+def test_shortened_history_rebuilds(tmp_path, data):
+    store = ResultStore(str(tmp_path))
+    store.update('X', data, 15, EXTRAS, fingerprint='a')
+    short = head(data, 2500)
+    stats = {}
+    result = store.update('X', short, 15, EXTRAS, fingerprint='b', stats=stats)
+    assert stats['bars_processed'] == 2500
+    assert_same(result, kernel.compute(short, 15, EXTRAS))
+
+
+def test_records_after_checkpoint_are_truncated(tmp_path, data):
+    store = ResultStore(str(tmp_path))
+    store.update('X', head(data, 3000), 15, EXTRAS, fingerprint='a')
+    directory = store.directory('X', 15, EXTRAS)
+    # records of an update, that was interrupted before its checkpoint was saved
+    for table, dtype in TABLES.items():
+        with open(os.path.join(directory, f'{table}.bin'), 'ab') as file:
+            np.ones(3, dtype=dtype).tofile(file)
+    result = store.update('X', data, 15, EXTRAS, fingerprint='b')
+    assert_same(result, kernel.compute(data, 15, EXTRAS))
+    lengths = store._load_checkpoint(directory)['lengths']
+    for table, dtype in TABLES.items():
+        assert os.path.getsize(os.path.join(directory, f'{table}.bin')) == lengths[table] * dtype.itemsize
+
+
+@pytest.mark.parametrize('candle_range', [5, 15, 100])
+@pytest.mark.parametrize('skip_oldest_box', [True, False])
+def test_resumed_kernel_equals_full_run(data, candle_range, skip_oldest_box):
+    # cuts past MAX_BLOCK_AGE, so resumed runs only look at the tail of history
+    cuts = [kernel.MAX_BLOCK_AGE + 500, kernel.MAX_BLOCK_AGE + 501, 3700, 4000]
+    state = None
+    parts = []
+    for cut in cuts:
+        events, state = kernel.run(head(data, cut), candle_range, EXTRAS, skip_oldest_box, state)
+        # state goes through checkpoint file between runs
+        state = pickle.loads(pickle.dumps(state))
+        parts.append(events)
+    events = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    assert_same(kernel.result_from_events(events, state), kernel.compute(data, candle_range, EXTRAS, skip_oldest_box))
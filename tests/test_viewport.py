@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from utils import kernel
+from utils.benchmark import random_walk_ohlcv
+from utils.viewport import ShapeIndex, relayout_range, visible_range
+
+ZOOM = ['2015-01-01', '2015-03-01']
+
+
+@pytest.mark.parametrize('bars', [1, 50, 5000])
+def test_shape_index_equals_brute_force(bars):
+    result = kernel.compute(random_walk_ohlcv(bars, seed=3), 15, ('showPD', 'showBearishBOS', 'showBullishBOS'))
+    index = ShapeIndex(result)
+    rng = np.random.default_rng(0)
+    ranges = [(0, bars), (bars - 1, bars), (0, 1)]
+    ranges += [tuple(sorted(rng.integers(0, bars + 1, 2))) for _ in range(300)]
+    for start, stop in ranges:
+        stop = max(stop, start + 1)
+        expected = result.take(np.flatnonzero((result.x0 <= stop - 1) & (result.x1 >= start)))
+        got = index.query(start, stop)
+        for name in ('x0', 'x1', 'y0', 'y1', 'style'):
+            np.testing.assert_array_equal(getattr(got, name), getattr(expected, name), err_msg=(start, stop, name))
+
+
+def test_relayout_range_zoom_and_autorange():
+    assert relayout_range(None) is None
+    assert relayout_range({'xaxis.range[0]': ZOOM[0], 'xaxis.range[1]': ZOOM[1]}) == ZOOM
+    assert relayout_range({'xaxis.range': ZOOM}, ['2010-01-01', '2011-01-01']) == ZOOM
+    assert relayout_range({'xaxis.autorange': True}, ZOOM) is None
+
+
+@pytest.mark.parametrize('relayout_data', [{'autosize': True}, {'yaxis.range[0]': 1, 'yaxis.range[1]': 2}, {}])
+def test_relayout_range_keeps_previous_on_other_events(relayout_data):
+    assert relayout_range(relayout_data, ZOOM) == ZOOM
+    assert relayout_range(relayout_data, None) is None
+
+
+def test_relayout_range_one_ended_drag():
+    assert relayout_range({'xaxis.range[0]': '2015-02-01'}, ZOOM) == ['2015-02-01', ZOOM[1]]
+    assert relayout_range({'xaxis.range[1]': '2015-02-01'}, ZOOM) == [ZOOM[0], '2015-02-01']
+    # drag from the whole history leaves the other end open
+    assert relayout_range({'xaxis.range[1]': '2015-02-01'}, None) == [None, '2015-02-01']
+
+
+def test_visible_range():
+    timestamps = np.datetime64('2015-01-01', 'D') + np.arange(100).astype('timedelta64[D]')
+    assert visible_range(None, timestamps) == (0, 100)
+    assert visible_range(['2015-01-11', '2015-01-20'], timestamps) == (9, 21)
+    assert visible_range([None, '2015-01-20'], timestamps) == (0, 21)
+    assert visible_range(['2015-01-11', None], timestamps) == (9, 100)
+    # out of data
+    assert visible_range(['2020-01-01', '2020-02-01'], timestamps) == (0, 100)
@@ -0,0 +1,169 @@
+"""Runs indicator over a universe of OHLCV csv files on a process pool and streams the shapes
+to columnar shard files, with per-symbol timings in summary file.
+Usage:
+    python -m utils.batch data/universe/ --output results/ --candle-range 15 --format parquet
+    python -m utils.batch manifest.txt --output results/
+Manifest is a text file with one csv path per line, symbol is the file name without extension.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from utils import kernel
+from utils.builtins import ShapeStore
+from utils.datasets import normalize_columns
+from utils.sweep import DEFAULT_EXTRAS
+
+
+def list_sources(path: str) -> dict:
+    """Returns symbol -> csv path of directory with csv files or of manifest file."""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.csv'))
+    else:
+        with open(path) as manifest:
+            base = os.path.dirname(path)
+            files = [os.path.join(base, line.strip()) for line in manifest
+                     if line.strip() and not line.startswith('#')]
+    return {os.path.splitext(os.path.basename(file))[0]: file for file in files}
+
+
+def run_symbol(symbol: str, path: str, candle_range: int, extras=DEFAULT_EXTRAS):
+    """Loads one csv and runs indicator on it. Returns (summary dict, shape columns dict)."""
+    started = time.perf_counter()
+    dataframe = normalize_columns(pd.read_csv(path))
+    loaded = time.perf_counter()
+    result = kernel.compute(dataframe, candle_range, extras)
+    computed = time.perf_counter()
+    dates = np.asarray(dataframe['date']).astype(str)
+    styles = result.styles
+    shapes = {
+        'symbol': np.full(len(result), symbol, dtype=object),
+        'kind': np.where(result.kind == ShapeStore.BOX, 'box', 'line'),
+        'x0': dates[result.x0],
+        'x1': dates[result.x1],
+        'y0': result.y0,
+        'y1': result.y1,
+        'colour': np.array([styles[style_id][1] for style_id in result.style], dtype=object),
+    }
+    summary = {
+        'symbol': symbol,
+        'bars': len(dataframe),
+        'shapes': len(result),
+        'load_seconds': loaded - started,
+        'compute_seconds': computed - loaded,
+    }
+    return summary, shapes
+
+
+class ShardWriter:
+    """Collects shape columns and writes them to numbered shard files of about shard_rows rows."""
+    def __init__(self, directory: str, file_format: str = 'csv', shard_rows: int = 1_000_000):
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise RuntimeError('Parquet output needs pyarrow: pip install pyarrow') from None
+        self.directory = directory
+        self.file_format = file_format
+        self.shard_rows = shard_rows
+        self.shards: int = 0
+        self._pending = []
+        self._pending_rows: int = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, columns: dict):
+        self._pending.append(pd.DataFrame(columns))
+        self._pending_rows += len(self._pending[-1])
+        if self._pending_rows >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending_rows:
+            return
+        frame = pd.concat(self._pending, ignore_index=True)
+        path = os.path.join(self.directory, f'shapes-{self.shards:05d}.{self.file_format}')
+        if self.file_format == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+        self.shards += 1
+        self._pending = []
+        self._pending_rows = 0
+
+
+def run_batch(sources: dict, output: str, candle_range: int = 15, extras=DEFAULT_EXTRAS, workers: int = None,
+              file_format: str = 'csv', shard_rows: int = 1_000_000, progress=None) -> list:
+    """Runs indicator for every symbol -> csv path of sources on process pool and writes shapes to output directory.
+     At most 2 * workers symbols are in flight, so memory doesn't grow with the size of universe.
+     Symbol, that fails (unreadable file, missing columns), gets its error in summary and the batch goes on.
+     progress(done, total, summary) is called after each symbol. Returns list of summaries."""
+    workers = workers or os.cpu_count()
+    writer = ShardWriter(output, file_format, shard_rows)
+    summaries = []
+    pending = iter(sources.items())
+    with ProcessPoolExecutor(workers) as executor:
+        in_flight = {}
+        while True:
+            while len(in_flight) < 2 * workers:
+                source = next(pending, None)
+                if source is None:
+                    break
+                in_flight[executor.submit(run_symbol, *source, candle_range, tuple(extras))] = source[0]
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol = in_flight.pop(future)
+                try:
+                    summary, shapes = future.result()
+                except Exception as error:
+                    summary = {'symbol': symbol, 'error': f'{type(error).__name__}: {error}'}
+                else:
+                    writer.write(shapes)
+                summaries.append(summary)
+                if progress:
+                    progress(len(summaries), len(sources), summary)
+    writer.flush()
+    summary_frame = pd.DataFrame(summaries, columns=['symbol', 'bars', 'shapes', 'load_seconds', 'compute_seconds',
+                                                     'error'])
+    # failed symbols have no counts, nullable ints keep the others from becoming floats
+    summary_frame.astype({'bars': 'Int64', 'shapes': 'Int64'}).to_csv(os.path.join(output, 'summary.csv'), index=False)
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run indicator over many OHLCV csv files.')
+    parser.add_argument('source', help='directory with csv files or manifest file with csv paths')
+    parser.add_argument('--output', required=True, help='directory for shape shards and summary.csv')
+    parser.add_argument('--candle-range', type=int, default=15)
+    parser.add_argument('--extras', nargs='*', default=list(DEFAULT_EXTRAS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--shard-rows', type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    sources = list_sources(args.source)
+    started = time.perf_counter()
+
+    def progress(done, total, summary):
+        if 'error' in summary:
+            print(f'[{done}/{total}] {summary["symbol"]}: failed, {summary["error"]}', file=sys.stderr)
+            return
+        print(f'[{done}/{total}] {summary["symbol"]}: {summary["bars"]} bars, {summary["shapes"]} shapes, '
+              f'load {summary["load_seconds"]:.2f}s, compute {summary["compute_seconds"]:.2f}s', file=sys.stderr)
+
+    summaries = run_batch(sources, args.output, args.candle_range, args.extras, args.workers, args.format,
+                          args.shard_rows, progress)
+    failed = sum('error' in summary for summary in summaries)
+    print(f'{len(sources)} symbols in {time.perf_counter() - started:.2f}s, {failed} failed', file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
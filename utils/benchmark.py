@@ -0,0 +1,173 @@
+"""Benchmark of indicator hot path on seeded random walk OHLCV.
+Times computation, shape materialization and figure build separately for every size and candle_range,
+reports bars per second and peak memory, and can compare the results with stored baseline.
+Usage:
+    python -m utils.benchmark --bars 1000 100000 1000000 --candle-range 5 15 100 --save bench.json
+    python -m utils.benchmark --bars 1000 100000 --baseline bench.json --tolerance 0.25
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils import kernel, render
+from utils.builtins import TradeView
+from utils.indicator import CustomTradeIndicator
+from utils.sweep import DEFAULT_EXTRAS
+
+STAGES = ('windows', 'compute', 'kernel', 'shapes', 'traces', 'figure')
+
+
+def random_walk_ohlcv(bars: int, seed: int = 0, start: str = '2000-01-03', step: str = 'm') -> dict:
+    """Returns dict of OHLCV columns with bars of geometric random walk, the same for the same seed.
+     Dates are datetime64 with one bar per step ('m' minute, 'h' hour, 'D' day)."""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, bars)))
+    open_ = np.empty(bars)
+    open_[0] = 100
+    open_[1:] = close[:-1]
+    # some bars open with gap, some are flat
+    open_ *= np.where(rng.random(bars) < 0.01, np.exp(rng.normal(0, 0.01, bars)), 1)
+    flat = rng.random(bars) < 0.005
+    close[flat] = open_[flat]
+    spread = np.abs(rng.normal(0, 0.001, (2, bars))) * close
+    dates = np.datetime64(start, step) + np.arange(bars).astype(f'timedelta64[{step}]')
+    return {
+        'date': dates,
+        'timestamp': dates.astype('datetime64[ns]'),
+        'open': open_,
+        'high': np.maximum(open_, close) + spread[0],
+        'low': np.minimum(open_, close) - spread[1],
+        'close': close,
+        'volume': rng.integers(100, 10000, bars).astype(np.float64),
+    }
+
+
+def _windows(data, candle_range):
+    """Runs lowest/highest and structure low index pointer windows of indicator over all bars."""
+    tv = TradeView(data)
+    while True:
+        tv.lowest(tv.low(), candle_range, 1)
+        tv.highest(tv.high(), candle_range, 1)
+        tv.lowest_index(candle_range - 1, 1)
+        if not tv.step_forward:
+            break
+
+
+def _figure(data, result):
+    import plotly.graph_objects as go
+    figure = go.Figure(go.Candlestick(x=data['date'], open=data['open'], high=data['high'], low=data['low'],
+                                      close=data['close']))
+    render.render(figure, result, data['date'], mode='traces')
+    return figure.to_json()
+
+
+def _measure(function, memory: bool):
+    """Returns (result, seconds, peak bytes or None) of function call."""
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return value, seconds, peak
+
+
+def run_benchmark(sizes, candle_ranges, stages=STAGES, seed: int = 0, repeat: int = 1, memory: bool = True,
+                  extras=DEFAULT_EXTRAS, progress=None) -> list:
+    """Returns list of {'bars', 'candle_range', 'stage', 'seconds', 'bars_per_second', 'peak_bytes'}.
+     seconds is the best of repeat runs. Peak memory is measured in separate run under tracemalloc,
+     so its overhead doesn't affect timings."""
+    results = []
+    for bars in sizes:
+        data = random_walk_ohlcv(bars, seed)
+        for candle_range in candle_ranges:
+            result = None
+            for stage in stages:
+                if stage == 'windows':
+                    function = lambda: _windows(data, candle_range)
+                elif stage == 'compute':
+                    function = lambda: CustomTradeIndicator(None, data).compute(candle_range, list(extras))
+                elif stage == 'kernel':
+                    function = lambda: kernel.compute(data, candle_range, extras)
+                elif stage == 'shapes':
+                    function = lambda: render.shapes(result, data['date'])
+                elif stage == 'traces':
+                    function = lambda: render.shape_traces(result, data['date'])
+                else:
+                    function = lambda: _figure(data, result)
+                if stage in ('shapes', 'traces', 'figure') and result is None:
+                    result = CustomTradeIndicator(None, data).compute(candle_range, list(extras))
+                timings = []
+                for _ in range(repeat):
+                    value, seconds, _ = _measure(function, False)
+                    timings.append(seconds)
+                if stage == 'compute':
+                    result = value
+                peak = _measure(function, True)[2] if memory else None
+                seconds = min(timings)
+                results.append({
+                    'bars': bars,
+                    'candle_range': candle_range,
+                    'stage': stage,
+                    'seconds': seconds,
+                    'bars_per_second': bars / seconds if seconds else None,
+                    'peak_bytes': peak,
+                })
+                if progress:
+                    progress(results[-1])
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float = 0.2) -> list:
+    """Returns list of (result, baseline seconds) for results slower than baseline by more than tolerance."""
+    expected = {(item['bars'], item['candle_range'], item['stage']): item['seconds'] for item in baseline}
+    regressions = []
+    for item in results:
+        seconds = expected.get((item['bars'], item['candle_range'], item['stage']))
+        if seconds is not None and item['seconds'] > seconds * (1 + tolerance):
+            regressions.append((item, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark indicator on random walk OHLCV.')
+    parser.add_argument('--bars', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--candle-range', nargs='+', type=int, default=[5, 15, 100])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory")
+    parser.add_argument('--save', help='write results to this json file')
+    parser.add_argument('--baseline', help='compare with results json, exit with code 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs baseline (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    def progress(item):
+        peak = f'{item["peak_bytes"] / 2 ** 20:9.1f} MiB' if item['peak_bytes'] is not None else ''
+        print(f'{item["bars"]:>10} bars  range {item["candle_range"]:>4}  {item["stage"]:<8}'
+              f'{item["seconds"]:10.4f}s {item["bars_per_second"] or 0:14,.0f} bars/s {peak}')
+
+    results = run_benchmark(args.bars, args.candle_range, args.stages, args.seed, args.repeat,
+                            not args.no_memory, progress=progress)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for item, seconds in regressions:
+            print(f'REGRESSION {item["bars"]} bars range {item["candle_range"]} {item["stage"]}: '
+                  f'{item["seconds"]:.4f}s vs baseline {seconds:.4f}s', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
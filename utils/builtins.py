@@ -1,31 +1,128 @@
-from datetime import datetime
+import re
+from array import array
+from collections import deque
+from typing import TYPE_CHECKING
 
-import pandas as pd
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class TradeView:
-    def __init__(self, dataframe: pd.DataFrame):
+    def __init__(self, dataframe: 'pd.DataFrame'):
         """Creates TradeView's Pive Script builtins emulation interface,
          that contains methods close to original."""
         self.dataframe = dataframe
+        # columns are pulled once into contiguous arrays, so accessors read a scalar instead of a whole row
+        self._open = self._price_column('open')
+        self._high = self._price_column('high')
+        self._low = self._price_column('low')
+        self._close = self._price_column('close')
+        self._date = np.asarray(dataframe['date'])
+        self._timestamp = timestamps_of(dataframe)
         self._bar_index: int = 0
-        self.last_idx: int = len(dataframe) - 1
+        self.last_idx: int = len(self._close) - 1
+        # sliding windows of lowest()/highest(), keyed by (column, length, bar_idx_in_past)
+        self._windows = {}
+        # columns of all boxes and lines, created by new_box()/new_line()
+        self.shape_store = ShapeStore()
 
-        self.curr_datetime = datetime.strptime(self.bar_date(), '%Y-%m-%d')
-        self.last_cycle_date = self.curr_datetime
+        # higher timeframe buckets with their open/high/low/close, built on the first use of each resolution
+        self._timeframes = {}
+        self._security_columns = {self.open: 'open', self.high: 'high', self.low: 'low', self.close: 'close'}
+        self.last_cycle_date = self._timestamp[0] if len(self._timestamp) else None
 
     def security(self, symbol: str, resolution: str, expression, bar_idx_in_past):
-        curr_datetime = datetime.strptime(self.bar_date(), '%Y-%m-%d')
-        if resolution == 'D':
-            if datetime.strptime(self.bar_date(self._bar_index - 1), '%Y-%m-%d').day != curr_datetime.day:
-                self.last_cycle_date = curr_datetime
+        """Returns value of expression on higher timeframe bar bar_idx_in_past bars before current,
+         on the first bar of a new higher timeframe bar. Returns None on other bars.
+         Resolution is Pine Script timeframe: '15', '240' minutes, '4H' hours, 'D', 'W', 'M', '3M' etc.
+         Builtins open/high/low/close give open/high/low/close of the whole higher timeframe bar,
+         other expressions are called with bar_idx_in_past. Never looks at bars after current."""
+        timeframe = self.timeframe(resolution)
+        bar_idx = self._bar_index
+        bucket = timeframe.bucket[bar_idx]
+        if bar_idx and timeframe.bucket[bar_idx - 1] != bucket:
+            self.last_cycle_date = self._timestamp[bar_idx]
+            column = self._security_columns.get(expression)
+            if column is None or bar_idx_in_past <= 0:
                 return expression(bar_idx_in_past)
+            return getattr(timeframe, column)[max(bucket - bar_idx_in_past, 0)]
+
+    def security_series(self, resolution: str, column: str, bar_idx_in_past: int = 1):
+        """Returns array with value of higher timeframe column ('open', 'high', 'low', 'close') for every bar.
+         bar_idx_in_past=0 gives values of the forming higher timeframe bar, aggregated only up to each bar,
+         so the series never looks at bars after the one it is aligned to. Bars without such history get nan."""
+        timeframe = self.timeframe(resolution)
+        buckets = np.array(timeframe.bucket, dtype=np.int64)
+        if bar_idx_in_past > 0:
+            past = buckets - bar_idx_in_past
+            values = np.array(getattr(timeframe, column), dtype=np.float64)[np.maximum(past, 0)]
+            return np.where(past >= 0, values, np.nan)
+        size = self.last_idx + 1
+        if column == 'close':
+            return self._close[:size].copy()
+        if column == 'open':
+            return np.array(timeframe.open, dtype=np.float64)[buckets]
+        import pandas as pd
+        values = pd.Series(getattr(self, f'_{column}')[:size]).groupby(buckets)
+        return (values.cummax() if column == 'high' else values.cummin()).to_numpy()
+
+    def timeframe(self, resolution: str):
+        """Returns TimeframeBuckets of resolution, building it once per resolution."""
+        timeframe = self._timeframes.get(resolution)
+        if timeframe is None:
+            size = self.last_idx + 1
+            timeframe = TimeframeBuckets(timeframe_keys(self._timestamp[:size], resolution),
+                                         self._open[:size], self._high[:size], self._low[:size], self._close[:size])
+            self._timeframes[resolution] = timeframe
+        return timeframe
+
+    def append_bar(self, ohlcv):
+        """Appends new bar after the last one. ohlcv is mapping with date, open, high, low, close keys.
+         Columns grow by doubling capacity, so appending costs amortized O(1)."""
+        bar_idx = self.last_idx + 1
+        if bar_idx >= len(self._close):
+            self._grow(max(2 * len(self._close), 16))
+        self._date[bar_idx] = ohlcv['date']
+        self._open[bar_idx] = ohlcv['open']
+        self._high[bar_idx] = ohlcv['high']
+        self._low[bar_idx] = ohlcv['low']
+        self._close[bar_idx] = ohlcv['close']
+        import pandas as pd
+        self._timestamp[bar_idx] = pd.Timestamp(ohlcv['date']).to_datetime64()
+        self.last_idx = bar_idx
+        for resolution, timeframe in self._timeframes.items():
+            timeframe.append(timeframe_keys(self._timestamp[bar_idx:bar_idx + 1], resolution)[0],
+                             self._open[bar_idx], self._high[bar_idx], self._low[bar_idx], self._close[bar_idx])
+
+    def _grow(self, capacity: int):
+        """Reallocates columns to hold capacity bars."""
+        size = self.last_idx + 1
+        for name in ('_open', '_high', '_low', '_close', '_date', '_timestamp'):
+            values = getattr(self, name)
+            grown = np.empty(capacity, dtype=object if name == '_date' else values.dtype)
+            grown[:size] = values[:size]
+            setattr(self, name, grown)
+        for (column, _, _), window in self._windows.items():
+            window.values = getattr(self, f'_{column}')
+
+    @property
+    def dates(self):
+        """Returns array of bar dates, from the first to the last bar."""
+        return self._date[:self.last_idx + 1]
+
+    def _price_column(self, name: str):
+        """Returns dataframe price column as contiguous float64 array."""
+        return np.ascontiguousarray(self.dataframe[name], dtype=np.float64)
 
     @property
     def step_forward(self):
         """Increments _bar_index counter to the next bar. Returns True, if next bar exist."""
         if self._bar_index < self.last_idx:
             self._bar_index += 1
+            for (_, length, bar_idx_in_past), window in self._windows.items():
+                window.update(*self._window_bounds(length, bar_idx_in_past))
             return True
 
     def bar_index(self, bar_idx_in_past: int = 0):
@@ -35,7 +132,7 @@ class TradeView:
 
     def bar_date(self, bar_idx: int = 0):
         """Returns date of bar index."""
-        return self.dataframe.iloc[self._do_valid_absolute_idx(bar_idx)]['date']
+        return self._date[self._do_valid_absolute_idx(bar_idx)]
 
     def _do_relative_past_idx_to_idx(self, bar_idx_in_past: int = 0):
         """Returns valid bar index, relative to current.
@@ -54,45 +151,62 @@ class TradeView:
         """Returns close price value of bar at bar_idx_in_past bars in the past.
          Without args returns current bar close price value.
          Positive bar_idx_in_past will return value of bar in the past."""
-        return self.dataframe.iloc[self._do_relative_past_idx_to_idx(bar_idx_in_past)]['close']
+        return self._close[self._do_relative_past_idx_to_idx(bar_idx_in_past)]
 
     def open(self, bar_idx_in_past: int = 0):
         """Returns open price value of bar at bar_idx_in_past bars in the past.
          Without args returns current bar open price value.
          Positive bar_idx_in_past will return value of bar in the past."""
-        return self.dataframe.iloc[self._do_relative_past_idx_to_idx(bar_idx_in_past)]['open']
+        return self._open[self._do_relative_past_idx_to_idx(bar_idx_in_past)]
 
     def low(self, bar_idx_in_past: int = 0):
         """Returns low price value of bar at bar_idx_in_past bars in the past.
          Without args returns current bar low price value.
          Positive bar_idx_in_past will return value of bar in the past."""
-        return self.dataframe.iloc[self._do_relative_past_idx_to_idx(bar_idx_in_past)]['low']
+        return self._low[self._do_relative_past_idx_to_idx(bar_idx_in_past)]
 
     def high(self, bar_idx_in_past: int = 0):
         """Returns high price value of bar at bar_idx_in_past bars in the past.
          Without args returns current bar high price value.
          Positive bar_idx_in_past will return value of bar in the past."""
-        return self.dataframe.iloc[self._do_relative_past_idx_to_idx(bar_idx_in_past)]['high']
+        return self._high[self._do_relative_past_idx_to_idx(bar_idx_in_past)]
 
     def lowest(self, source: float = None, length: int = 1, bar_idx_in_past: int = 0):
         """Returns the lowest price value of last few bars from bar_idx_in_past to length in the past from current bar.
          Without bar_idx_in_past returns lowest from bars before current bar.
          Positive bar_idx_in_past will give bars before current bar."""
-        segment = self.dataframe.iloc[
-                  self._do_relative_past_idx_to_idx(bar_idx_in_past + length):
-                  self._do_relative_past_idx_to_idx(bar_idx_in_past - 1)
-                  ]['low']
-        return min(segment, default=source)
+        return self._window('low', length, bar_idx_in_past).value(source)
 
     def highest(self, source: float = None, length: int = 1, bar_idx_in_past: int = 0):
         """Returns the highest price value of last few bars from bar_idx_in_past to length in the past from current bar.
          Without bar_idx_in_past returns highest from bars before current bar.
          Positive bar_idx_in_past will give bars before current bar."""
-        segment = self.dataframe.iloc[
-                  self._do_relative_past_idx_to_idx(bar_idx_in_past + length):
-                  self._do_relative_past_idx_to_idx(bar_idx_in_past - 1)
-                  ]['high']
-        return max(segment, default=source)
+        return self._window('high', length, bar_idx_in_past).value(source)
+
+    def lowest_index(self, length: int = 1, bar_idx_in_past: int = 0):
+        """Returns bar index of the lowest low over the same bars as lowest(length, bar_idx_in_past).
+         The latest bar wins ties. Returns None, if there are no such bars."""
+        return self._window('low', length, bar_idx_in_past).index()
+
+    def highest_index(self, length: int = 1, bar_idx_in_past: int = 0):
+        """Returns bar index of the highest high over the same bars as highest(length, bar_idx_in_past).
+         The latest bar wins ties. Returns None, if there are no such bars."""
+        return self._window('high', length, bar_idx_in_past).index()
+
+    def _window(self, column: str, length: int, bar_idx_in_past: int):
+        """Returns sliding window over column, that is kept up to date by step_forward."""
+        key = (column, length, bar_idx_in_past)
+        window = self._windows.get(key)
+        if window is None:
+            window = RollingExtremum(getattr(self, f'_{column}'), 'min' if column == 'low' else 'max')
+            window.update(*self._window_bounds(length, bar_idx_in_past))
+            self._windows[key] = window
+        return window
+
+    def _window_bounds(self, length: int, bar_idx_in_past: int):
+        """Returns [start, end) bar indexes, that lowest()/highest() look at on current bar."""
+        return (self._do_relative_past_idx_to_idx(bar_idx_in_past + length),
+                self._do_relative_past_idx_to_idx(bar_idx_in_past - 1))
 
     @staticmethod
     def crossunder(x, y):
@@ -109,40 +223,113 @@ class TradeView:
             if x() < y() and x(1) > y(1):
                 return True
 
-    # def calculate_sma(self, data: pd.DataFrame, period: int = 50):
-    #     def avg(d: pd.DataFrame):
-    #         return d['close'].mean()
-    #
-    #     result = []
-    #     for i in range(period - 1, len(data)):
-    #         val = avg(data.iloc[i - period + 1:i])
-    #         result.append({'time': data.iloc[i]['date'], f'SMA {period}': val})
-    #     return pd.DataFrame(result)
+    @staticmethod
+    def crossover(x, y):
+        """Returns True if current bar crossed over.
+         This means that result of x() greater than result of y(), but was lesser in the last bar.
+         One or both args must be builtins: low(), high(), open(), close(). One of args can be the float.
+         For whole columns at once use module level crossover()."""
+        if isinstance(y, float):
+            if x() > y > x(1):
+                return True
+        elif isinstance(x, float):
+            if y() < x < y(1):
+                return True
+        else:
+            if x() > y() and x(1) < y(1):
+                return True
 
     def new_box(self, x0: int, x1: int, y0: float, y1: float, xref: str = 'x', yref: str = 'y', line_width: int = 1,
                 fillcolor: str = 'rgb(100, 120, 120)'):
         """Creates instance of visual box shape to draw squares on plotly canvas.
+        x1=None extends the box to the last bar, also to bars appended later.
         To use: figure.add_shape(this.shape)"""
-        return self.Box(self, x0, x1, y0, y1, xref, yref, line_width, fillcolor)
+        style = self.shape_store.style_id(('box', fillcolor, line_width, xref, yref))
+        return self.Box(self, self.shape_store.add(ShapeStore.BOX, x0, x1, y0, y1, style))
 
     def new_line(self, x0: int, x1: int, y0: float, y1: float, xref: str = 'x', yref: str = 'y',
                  color: str = 'rgb(100, 120, 120)', width: int = 1):
         """Creates instance of visual box shape to draw squares on plotly canvas.
         To use: figure.add_shape(this.shape)"""
-        return self.Line(self, x0, x1, y0, y1, xref, yref, color, width)
+        style = self.shape_store.style_id(('line', color, width, xref, yref))
+        return self.Line(self, self.shape_store.add(ShapeStore.LINE, x0, x1, y0, y1, style))
 
-    class Box:
-        """Shape class to handle squares on plotly canvas. Don't use it, use TradeView.new_box(args) to create one."""
-        def __init__(self, tv, x0, x1, y0, y1, xref, yref, line_width, fillcolor):
+    class _Shape:
+        """Lightweight view of one row of TradeView.shape_store."""
+        __slots__ = ('tv', 'row')
+
+        def __init__(self, tv, row: int):
             self.tv = tv
-            self.x0 = x0
-            self.x1 = x1
-            self.y0 = y0
-            self.y1 = y1
-            self.xref = xref
-            self.yref = yref
-            self.line_width = line_width
-            self.fillcolor = fillcolor
+            self.row = row
+
+        @property
+        def x0(self):
+            return int(self.tv.shape_store.x0[self.row])
+
+        @x0.setter
+        def x0(self, value: int):
+            self.tv.shape_store.x0[self.row] = value
+
+        @property
+        def x1(self):
+            x1 = int(self.tv.shape_store.x1[self.row])
+            return None if x1 == ShapeStore.LAST_BAR else x1
+
+        @x1.setter
+        def x1(self, value: int):
+            self.tv.shape_store.x1[self.row] = ShapeStore.LAST_BAR if value is None else value
+
+        @property
+        def y0(self):
+            return self.tv.shape_store.y0[self.row]
+
+        @y0.setter
+        def y0(self, value: float):
+            self.tv.shape_store.y0[self.row] = value
+
+        @property
+        def y1(self):
+            return self.tv.shape_store.y1[self.row]
+
+        @y1.setter
+        def y1(self, value: float):
+            self.tv.shape_store.y1[self.row] = value
+
+        @property
+        def style(self):
+            """Returns (kind, colour, width) tuple, that shapes drawn alike share."""
+            return self.tv.shape_store.styles[self.tv.shape_store.style[self.row]][:3]
+
+        @property
+        def xref(self):
+            return self.tv.shape_store.styles[self.tv.shape_store.style[self.row]][3]
+
+        @property
+        def yref(self):
+            return self.tv.shape_store.styles[self.tv.shape_store.style[self.row]][4]
+
+        @property
+        def get_left(self):
+            """Returns left bar index int()"""
+            return self.x0
+
+        @property
+        def get_right(self):
+            """Returns right bar index int(). Shape without x1 ends on the last bar."""
+            x1 = self.x1
+            return self.tv.last_idx if x1 is None else x1
+
+    class Box(_Shape):
+        """Shape class to handle squares on plotly canvas. Don't use it, use TradeView.new_box(args) to create one."""
+        __slots__ = ()
+
+        @property
+        def line_width(self):
+            return self.style[2]
+
+        @property
+        def fillcolor(self):
+            return self.style[1]
 
         @property
         def get_top(self):
@@ -154,36 +341,30 @@ class TradeView:
             """Returns bottom value float()"""
             return self.y0
 
-        @property
-        def get_left(self):
-            """Returns left bar index int()"""
-            return self.x0
-
         @property
         def shape(self):
             """Returns dict() to draw plotly shape.
              Use as figure.add_shape(this.shape)"""
             return {
-                'x0': self.tv.bar_date(self.x0), 'x1': self.tv.bar_date(self.x1),
+                'x0': self.tv.bar_date(self.x0), 'x1': self.tv.bar_date(self.get_right),
                 'y0': self.y0, 'y1': self.y1,
                 'xref': self.xref, 'yref': self.yref,
                 'line_width': self.line_width,
                 'fillcolor': self.fillcolor,
             }
 
-    class Line:
+    class Line(_Shape):
         """Shape class to handle lines on plotly canvas.
          Don't use it, use TradeView.new_line(args) to create one."""
-        def __init__(self, tv, x0, x1, y0, y1, xref, yref, color, width):
-            self.tv = tv
-            self.x0 = x0
-            self.x1 = x1
-            self.y0 = y0
-            self.y1 = y1
-            self.xref = xref
-            self.yref = yref
-            self.color = color
-            self.width = width
+        __slots__ = ()
+
+        @property
+        def color(self):
+            return self.style[1]
+
+        @property
+        def width(self):
+            return self.style[2]
 
         @property
         def shape(self):
@@ -191,7 +372,7 @@ class TradeView:
              Use as figure.add_shape(this.shape)"""
             return {
                 'type': 'line',
-                'x0': self.tv.bar_date(self.x0), 'x1': self.tv.bar_date(self.x1),
+                'x0': self.tv.bar_date(self.x0), 'x1': self.tv.bar_date(self.get_right),
                 'y0': self.y0, 'y1': self.y1,
                 'xref': self.xref, 'yref': self.yref,
                 'line': {
@@ -199,3 +380,305 @@ class TradeView:
                     'width': self.width,
                 }
             }
+
+
+class ShapeStore:
+    """Growable struct-of-arrays storage of all boxes and lines, created by TradeView.
+     Row has int32 bar indexes x0/x1, float64 prices y0/y1, uint8 kind and uint16 style id,
+     that points to (kind, colour, width, xref, yref) tuple in styles palette.
+     Rows are never removed, so Box and Line views stay valid."""
+    BOX = 0
+    LINE = 1
+    # x1 of shape, that extends to the last bar
+    LAST_BAR = -1
+    COLUMNS = ('x0', 'x1', 'y0', 'y1', 'kind', 'style')
+
+    def __init__(self, capacity: int = 64):
+        self.size: int = 0
+        self.x0 = np.empty(capacity, dtype=np.int32)
+        self.x1 = np.empty(capacity, dtype=np.int32)
+        self.y0 = np.empty(capacity, dtype=np.float64)
+        self.y1 = np.empty(capacity, dtype=np.float64)
+        self.kind = np.empty(capacity, dtype=np.uint8)
+        self.style = np.empty(capacity, dtype=np.uint16)
+        self.styles = []
+        self._style_ids = {}
+
+    def style_id(self, style: tuple) -> int:
+        """Returns palette id of (kind, colour, width, xref, yref) style, adding it if it is new."""
+        style_id = self._style_ids.get(style)
+        if style_id is None:
+            style_id = self._style_ids[style] = len(self.styles)
+            self.styles.append(style)
+        return style_id
+
+    def add(self, kind: int, x0: int, x1: int, y0: float, y1: float, style: int) -> int:
+        """Appends shape row and returns its number. x1=None stores LAST_BAR."""
+        row = self.size
+        if row == len(self.x0):
+            self._grow(max(2 * row, 64))
+        self.x0[row] = x0
+        self.x1[row] = self.LAST_BAR if x1 is None else x1
+        self.y0[row] = y0
+        self.y1[row] = y1
+        self.kind[row] = kind
+        self.style[row] = style
+        self.size += 1
+        return row
+
+    def _grow(self, capacity: int):
+        for name in self.COLUMNS:
+            values = getattr(self, name)
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            setattr(self, name, grown)
+
+    def columns(self) -> dict:
+        """Returns views of filled part of columns, without copying."""
+        return {name: getattr(self, name)[:self.size] for name in self.COLUMNS}
+
+    def __len__(self):
+        return self.size
+
+
+def timestamps_of(dataframe):
+    """Returns bar dates of dataframe (or Dataset, or dict of arrays) as datetime64 array.
+     Uses 'timestamp' column, if dataframe was loaded with it, parses 'date' column otherwise."""
+    if 'timestamp' in dataframe:
+        return np.asarray(dataframe['timestamp'], dtype='datetime64[ns]')
+    import pandas as pd
+    return pd.to_datetime(np.asarray(dataframe['date'])).to_numpy(dtype='datetime64[ns]')
+
+
+def timeframe_keys(timestamps, resolution: str):
+    """Returns int64 bucket key for every datetime64 timestamp, equal keys share higher timeframe bar.
+     Resolution is Pine Script timeframe: number of minutes ('1', '15', '240'), or number with unit
+     'H' hours, 'D' days, 'W' weeks (from Monday), 'M' months, like '4H', 'D', '2W', 'M', '3M'."""
+    match = re.fullmatch(r'(\d*)([HDWM]?)', resolution)
+    if not match or not resolution or int(match[1] or 1) == 0:
+        raise ValueError(f'Unsupported resolution: {resolution!r}')
+    count = int(match[1] or 1)
+    unit = match[2]
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    if unit == 'M':
+        return timestamps.astype('datetime64[M]').astype(np.int64) // count
+    if unit == 'W':
+        # 1970-01-01 is Thursday, shift by 3 days so weeks start on Monday
+        return (timestamps.astype('datetime64[D]').astype(np.int64) + 3) // (7 * count)
+    if unit == 'D':
+        return timestamps.astype('datetime64[D]').astype(np.int64) // count
+    minutes = count * 60 if unit == 'H' else count
+    return timestamps.astype('datetime64[m]').astype(np.int64) // minutes
+
+
+class TimeframeBuckets:
+    """Splits bars into higher timeframe buckets by nondecreasing bucket key (like day number)
+     and keeps open/high/low/close of every bucket. Built once with vectorized reduceat,
+     then extended bar by bar with append(). bucket[bar_idx] is bucket number of bar."""
+    def __init__(self, keys, open_, high, low, close):
+        keys = np.asarray(keys, dtype=np.int64)
+        new_bucket = np.empty(len(keys), dtype=bool)
+        new_bucket[:1] = True
+        np.not_equal(keys[1:], keys[:-1], out=new_bucket[1:])
+        starts = np.flatnonzero(new_bucket)
+        ends = np.append(starts[1:], len(keys)) - 1
+        self.bucket = array('q', (np.cumsum(new_bucket) - 1).tobytes())
+        self.keys = array('q', keys[starts].tobytes())
+        self.open = array('d', np.asarray(open_, dtype=np.float64)[starts].tobytes())
+        self.close = array('d', np.asarray(close, dtype=np.float64)[ends].tobytes())
+        self.high = array('d')
+        self.low = array('d')
+        if len(starts):
+            self.high.frombytes(np.maximum.reduceat(np.asarray(high, dtype=np.float64), starts).tobytes())
+            self.low.frombytes(np.minimum.reduceat(np.asarray(low, dtype=np.float64), starts).tobytes())
+
+    def append(self, key: int, open_: float, high: float, low: float, close: float):
+        """Adds next bar to the last bucket, or starts new bucket if key has changed."""
+        if self.keys and self.keys[-1] == key:
+            self.high[-1] = max(self.high[-1], high)
+            self.low[-1] = min(self.low[-1], low)
+            self.close[-1] = close
+        else:
+            self.keys.append(key)
+            self.open.append(open_)
+            self.high.append(high)
+            self.low.append(low)
+            self.close.append(close)
+        self.bucket.append(len(self.keys) - 1)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class RollingExtremum:
+    """Sliding window minimum or maximum of price column, that also knows the bar index of it.
+     Keeps monotonic deque of bar indexes, so every bar is pushed and popped once - amortized O(1) per bar.
+     Don't use it, use TradeView.lowest()/highest() or their *_index() versions."""
+    def __init__(self, values, mode: str = 'min'):
+        self.values = values
+        self.mode = mode
+        self.start: int = 0
+        self.end: int = 0
+        self._queue = deque()
+
+    def update(self, start: int, end: int):
+        """Moves window to bars [start, end). Moving any bound back rebuilds window from start."""
+        values = self.values
+        queue = self._queue
+        if start < self.start or end < self.end:
+            queue.clear()
+            self.end = start
+        while self.end < end:
+            value = values[self.end]
+            # equal values are dropped too, so the latest bar wins ties
+            if self.mode == 'min':
+                while queue and values[queue[-1]] >= value:
+                    queue.pop()
+            else:
+                while queue and values[queue[-1]] <= value:
+                    queue.pop()
+            queue.append(self.end)
+            self.end += 1
+        while queue and queue[0] < start:
+            queue.popleft()
+        self.start = start
+
+    def value(self, default: float = None):
+        """Returns extremum value of window, or default if window is empty."""
+        return self.values[self._queue[0]] if self._queue else default
+
+    def index(self):
+        """Returns bar index of extremum, or None if window is empty."""
+        return self._queue[0] if self._queue else None
+
+
+# Vectorized Pine Script series functions. Each takes whole columns (arrays or pandas Series)
+# and returns float64 numpy array with value for every bar, NaN where Pine Script gives na.
+
+def shift(source, periods: int = 1, fill: float = np.nan):
+    """Returns source[periods] series: value periods bars back (forward for negative periods), fill where there is none."""
+    source = np.asarray(source, dtype=np.float64)
+    result = np.full(len(source), fill, dtype=np.float64)
+    # shift by whole length or more leaves only fill
+    periods = int(np.sign(periods)) * min(abs(periods), len(source))
+    if periods >= 0:
+        result[periods:] = source[:len(source) - periods]
+    else:
+        result[:len(source) + periods] = source[-periods:]
+    return result
+
+
+def _rolling_extremum(source, length: int, min_periods: int, function, fill: float):
+    # van Herk/Gil-Werman: running extremum from the start and from the end of every length sized block,
+    # window [s, s + length) is covered by the end part of one block and the start part of the next one
+    source = np.asarray(source, dtype=np.float64)
+    size = len(source)
+    if length < 1:
+        raise ValueError(f'length must be positive, got {length}')
+    blocks = -(-(size + length - 1) // length)
+    padded = np.full(blocks * length, fill, dtype=np.float64)
+    padded[length - 1:length - 1 + size] = source
+    padded = padded.reshape(blocks, length)
+    from_start = function.accumulate(padded, axis=1).ravel()
+    from_end = function.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    result = function(from_end[:size], from_start[length - 1:length - 1 + size])
+    result[:min(size, (length if min_periods is None else max(min_periods, 1)) - 1)] = np.nan
+    return result
+
+
+def rolling_min(source, length: int, min_periods: int = None):
+    """Returns ta.lowest(source, length): the lowest value of the last length bars, including current bar.
+     NaN on the first min_periods - 1 bars (default: length - 1 bars), then over the bars that exist. O(N) for any length."""
+    return _rolling_extremum(source, length, min_periods, np.minimum, np.inf)
+
+
+def rolling_max(source, length: int, min_periods: int = None):
+    """Returns ta.highest(source, length): the highest value of the last length bars, including current bar.
+     NaN on the first min_periods - 1 bars (default: length - 1 bars), then over the bars that exist. O(N) for any length."""
+    return _rolling_extremum(source, length, min_periods, np.maximum, -np.inf)
+
+
+def rolling_mean(source, length: int, min_periods: int = None):
+    """Returns mean of the last length bars. O(N), with compensated summation of pandas rolling."""
+    import pandas as pd
+    return pd.Series(np.asarray(source, dtype=np.float64)).rolling(length, min_periods).mean().to_numpy()
+
+
+def rolling_std(source, length: int, min_periods: int = None, ddof: int = 0):
+    """Returns standard deviation of the last length bars, biased (ddof=0) like ta.stdev."""
+    import pandas as pd
+    return pd.Series(np.asarray(source, dtype=np.float64)).rolling(length, min_periods).std(ddof).to_numpy()
+
+
+def sma(source, length: int):
+    """Returns ta.sma(source, length)."""
+    return rolling_mean(source, length)
+
+
+def ema(source, length: int):
+    """Returns ta.ema(source, length): alpha = 2 / (length + 1), starts from the first source value."""
+    import pandas as pd
+    source = np.asarray(source, dtype=np.float64)
+    return pd.Series(source).ewm(alpha=2 / (length + 1), adjust=False).mean().to_numpy()
+
+
+def rma(source, length: int):
+    """Returns ta.rma(source, length), moving average of RSI and ATR: alpha = 1 / length,
+     NaN on the first length - 1 bars, starts from sma(source, length)."""
+    source = np.asarray(source, dtype=np.float64)
+    result = np.full(len(source), np.nan)
+    if len(source) >= length:
+        import pandas as pd
+        seeded = source[length - 1:].copy()
+        seeded[0] = source[:length].mean()
+        result[length - 1:] = pd.Series(seeded).ewm(alpha=1 / length, adjust=False).mean().to_numpy()
+    return result
+
+
+def true_range(high, low, close):
+    """Returns ta.tr(true): high - low on the first bar, then the widest of high - low and gaps from previous close."""
+    high, low = np.asarray(high, dtype=np.float64), np.asarray(low, dtype=np.float64)
+    previous_close = shift(close)
+    # fmax ignores NaN of previous close on the first bar
+    return np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+
+
+def atr(high, low, close, length: int = 14):
+    """Returns ta.atr(length): rma of true range."""
+    return rma(true_range(high, low, close), length)
+
+
+def crossover(x, y):
+    """Returns bool mask of bars, where x crossed over y: x is greater than y, but was lesser on the previous bar.
+     x and y are series or numbers. Comparisons are strict, as in TradeView.crossover()."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    return (x > y) & (shift(x) < (shift(y) if y.ndim else y))
+
+
+def crossunder(x, y):
+    """Returns bool mask of bars, where x crossed under y: x is lesser than y, but was greater on the previous bar.
+     x and y are series or numbers. Comparisons are strict, as in TradeView.crossunder()."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    return (x < y) & (shift(x) > (shift(y) if y.ndim else y))
+
+
+def valuewhen(condition, source, occurrence: int = 0):
+    """Returns ta.valuewhen(): source value on the bar, where condition was true occurrence times back
+     (0 - the latest, including current bar), NaN before there were enough such bars."""
+    condition = np.asarray(condition, dtype=bool)
+    source = np.asarray(source, dtype=np.float64)
+    true_bars = np.flatnonzero(condition)
+    number = np.cumsum(condition) - 1 - occurrence
+    result = np.full(len(condition), np.nan)
+    found = number >= 0
+    result[found] = source[true_bars[number[found]]]
+    return result
+
+
+def barssince(condition):
+    """Returns ta.barssince(): number of bars since condition was true (0 on the bar, where it is true),
+     NaN before it was true first time."""
+    condition = np.asarray(condition, dtype=bool)
+    bars = np.arange(len(condition))
+    last_true = np.maximum.accumulate(np.where(condition, bars, -1))
+    return np.where(last_true >= 0, bars - last_true, np.nan)
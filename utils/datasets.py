@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.request
+from threading import Lock
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+# bump, when cached columns change, to rebuild caches written by older code
+CACHE_VERSION = 2
+
+
+def normalize_columns(dataframe: 'pd.DataFrame') -> 'pd.DataFrame':
+    """Lowercases column names and strips symbol prefixes like 'AAPL.Open' -> 'open'."""
+    dataframe.columns = dataframe.columns.str.lower()
+    dataframe.columns = [column.split('.')[-1] for column in dataframe.columns]
+    return dataframe
+
+
+class Dataset:
+    """Normalized OHLCV columns of one source. Columns are read-only arrays, memory-mapped from binary cache,
+     so every process, that opens the same dataset, shares one copy in page cache.
+     Can be passed anywhere dataframe is expected by TradeView: supports dataset['close'] and len(dataset)."""
+    def __init__(self, name: str, columns: dict, fingerprint: str):
+        self.name = name
+        self.columns = columns
+        self.fingerprint = fingerprint
+
+    def __getitem__(self, column: str):
+        return self.columns[column]
+
+    def __contains__(self, column: str):
+        return column in self.columns
+
+    def __len__(self):
+        return len(self.columns['date'])
+
+
+class DatasetStore:
+    """Loads each source once, normalizes its columns and keeps them as .npy files per column in cache_dir.
+     Cache is rebuilt only when source changes: file mtime/size for local files, ETag/Last-Modified for urls.
+     Remote sources are revalidated not more often than every remote_check_interval seconds."""
+    def __init__(self, sources: dict, cache_dir: str = 'data/.cache', remote_check_interval: float = 300):
+        self.sources = sources
+        self.cache_dir = cache_dir
+        self.remote_check_interval = remote_check_interval
+        self._datasets = {}
+        self._checked_at = {}
+        # lock per source: slow or unreachable remote source doesn't block requests of the others
+        self._locks = {}
+        self._lock = Lock()
+
+    def get(self, name: str) -> Dataset:
+        """Returns dataset of source name, loading it from cache or from source if it has changed."""
+        with self._lock:
+            lock = self._locks.setdefault(name, Lock())
+        with lock:
+            dataset = self._datasets.get(name)
+            link = self.sources[name]['link']
+            if dataset is not None and self._is_remote(link) \
+                    and time.monotonic() - self._checked_at[name] < self.remote_check_interval:
+                return dataset
+            validator = self._validator(link)
+            self._checked_at[name] = time.monotonic()
+            if dataset is not None and (validator is None or dataset.fingerprint == self._fingerprint(link, validator)):
+                return dataset
+            dataset = self._load_cached(name, link, validator)
+            if dataset is None:
+                dataset = self._build(name, link, validator)
+            self._datasets[name] = dataset
+            return dataset
+
+    def preload(self):
+        """Loads all sources, so the datasets are ready before serving requests.
+         Source, that can't be loaded, is logged and skipped: it fails on request instead."""
+        for name in self.sources:
+            try:
+                self.get(name)
+            except (OSError, ValueError, KeyError) as error:
+                # unreachable url, missing file, empty or malformed csv, no date column
+                log.warning('source %s is not preloaded: %s', name, error)
+
+    @staticmethod
+    def _is_remote(link: str) -> bool:
+        return link.startswith(('http://', 'https://'))
+
+    def _validator(self, link: str):
+        """Returns string, that changes whenever source content changes. None, if it can't be checked."""
+        if not self._is_remote(link):
+            stat = os.stat(link)
+            return f'{stat.st_mtime_ns}:{stat.st_size}'
+        try:
+            with urllib.request.urlopen(urllib.request.Request(link, method='HEAD'), timeout=5) as response:
+                return response.headers.get('ETag') or response.headers.get('Last-Modified')
+        except OSError:
+            return None
+
+    @staticmethod
+    def _fingerprint(link: str, validator: str) -> str:
+        return hashlib.blake2b(f'{link}\n{validator}'.encode(), digest_size=16).hexdigest()
+
+    def _dataset_dir(self, name: str) -> str:
+        safe_name = ''.join(char if char.isalnum() else '_' for char in name)
+        return os.path.join(self.cache_dir, safe_name)
+
+    def _load_cached(self, name: str, link: str, validator):
+        """Returns memory-mapped dataset from cache, if cache was built from the same source version."""
+        directory = self._dataset_dir(name)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION or meta['link'] != link \
+                or (validator is not None and meta['validator'] != validator):
+            return None
+        try:
+            columns = {column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+                       for column in meta['columns']}
+        except (OSError, ValueError):
+            return None
+        return Dataset(name, columns, self._fingerprint(link, meta['validator']))
+
+    def _build(self, name: str, link: str, validator) -> Dataset:
+        """Reads source, writes its columns to cache and returns memory-mapped dataset."""
+        import pandas as pd
+        dataframe = normalize_columns(pd.read_csv(link))
+        columns = {}
+        for column in COLUMNS:
+            if column not in dataframe:
+                continue
+            if column == 'date':
+                # fixed width strings instead of objects, so the column can be memory-mapped
+                columns[column] = dataframe[column].astype(str).to_numpy(dtype=str)
+            else:
+                columns[column] = dataframe[column].to_numpy(dtype=np.float64)
+        # dates parsed once here, TradeView uses them for day boundaries
+        columns['timestamp'] = pd.to_datetime(dataframe['date']).to_numpy(dtype='datetime64[ns]')
+
+        directory = self._dataset_dir(name)
+        os.makedirs(directory, exist_ok=True)
+        # files are written aside and moved in place, so other processes never see partial files
+        for column, values in columns.items():
+            path = os.path.join(directory, f'{column}.npy')
+            np.save(f'{path}.{os.getpid()}.tmp.npy', values)
+            os.replace(f'{path}.{os.getpid()}.tmp.npy', path)
+        meta_path = os.path.join(directory, 'meta.json')
+        with open(f'{meta_path}.{os.getpid()}.tmp', 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'link': link, 'validator': validator, 'columns': list(columns)}, file)
+        os.replace(f'{meta_path}.{os.getpid()}.tmp', meta_path)
+
+        return self._load_cached(name, link, validator) or Dataset(name, columns, self._fingerprint(link, validator))
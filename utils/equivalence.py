@@ -0,0 +1,241 @@
+"""Differential testing of indicator engines against frozen reference of the original bar by bar loop.
+Every engine must give exactly the same shapes, in the same order, and the same per bar candle colouring,
+on data/ohlcv.csv and on thousands of generated series with edge cases: flat bars, ties, gaps, tiny histories.
+Usage:
+    python -m utils.equivalence --cases 2000 --seed 0
+"""
+import argparse
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+from utils import kernel
+from utils.benchmark import random_walk_ohlcv
+from utils.builtins import ShapeStore, timeframe_keys, timestamps_of
+from utils.datasets import normalize_columns
+from utils.indicator import CustomTradeIndicator
+
+ALL_EXTRAS = ('showPD', 'showBearishBOS', 'showBullishBOS')
+
+
+def reference_indicator(data, candle_range: int, extras=ALL_EXTRAS, skip_oldest_box: bool = True):
+    """Frozen reference: the original Pine Script port as a plain bar by bar loop, with naive windows and lists.
+     Don't optimize it. Returns (shapes, candle_colour_mode, bos_candle), where shape is tuple
+     (kind, x0, x1, y0, y1, colour, width) in drawing order."""
+    open_, high, low, close = (np.asarray(data[column], dtype=np.float64).tolist()
+                               for column in ('open', 'high', 'low', 'close'))
+    days = timeframe_keys(timestamps_of(data), 'D').tolist()
+    last_idx = len(close) - 1
+    show_pd, show_bearish, show_bullish = (flag in extras for flag in ALL_EXTRAS)
+    first = 0 if not skip_oldest_box else 1
+
+    colour_mode, bos_candle = 0, False
+    last_down_index, last_down, last_low = 0, 0, 0
+    last_up_index, last_up_low, last_high = 0, 0, 0
+    last_long_index = 0
+    short_boxes, long_boxes, bos_lines = [], [], []
+    pd_lines = []
+    colour_modes, bos_candles = [], []
+    day_start = 0
+    for bar in range(last_idx + 1):
+        if bar and days[bar] != days[bar - 1]:
+            # previous day high/low at the first bar of a new day
+            pdh, pdl = max(high[day_start:bar]), min(low[day_start:bar])
+            day_start = bar
+            if show_pd and pdh:
+                pd_lines = [('line', 0, bar, pdh, pdh, 'LightBlue', 1), ('line', 0, bar, pdl, pdl, 'LightBlue', 1)]
+
+        window = range(max(0, bar - 1 - candle_range), bar)
+        structure_low = min((low[i] for i in window), default=low[bar])
+        min_value = max((high[i] for i in window), default=high[bar])
+        structure_low_index = bar
+        for i in range(1, candle_range + 1):
+            if low[max(0, bar - i)] < min_value:
+                min_value = low[max(0, bar - i)]
+                structure_low_index = max(0, bar - i)
+
+        if low[bar] < structure_low < low[max(0, bar - 1)] and bar - last_up_index < 1000:
+            short_boxes.append(['box', last_up_index, None, last_up_low, last_high, 'rgba(255,0,0,0.14)', 0])
+            if show_bearish:
+                bos_lines.append(('line', structure_low_index, bar, structure_low, structure_low, 'Red', 2))
+            bos_candle = True
+            colour_mode = 0
+
+        for i in range(len(short_boxes) - 1, first - 1, -1):
+            _, left, _, _, top, _, _ = short_boxes[i]
+            if close[bar] > top:
+                del short_boxes[i]
+                if bar - last_down_index < 1000 and bar > last_long_index:
+                    long_boxes.append(['box', last_down_index, None, last_low, last_down, 'rgba(0,255,0,0.14)', 0])
+                    if show_bullish:
+                        bos_lines.append(('line', left, bar, top, top, 'Green', 2))
+                    bos_candle = True
+                    colour_mode = 1
+                    last_long_index = bar
+
+        for i in range(len(long_boxes) - 1, first - 1, -1):
+            if close[bar] < long_boxes[i][3]:
+                del long_boxes[i]
+
+        colour_modes.append(colour_mode)
+        bos_candles.append(bos_candle)
+
+        if close[bar] < open_[bar]:
+            last_down, last_down_index, last_low = high[bar], bar, low[bar]
+        if close[bar] > open_[bar]:
+            last_up_index, last_up_low, last_high = bar, low[bar], high[bar]
+        last_high = max(last_high, high[bar])
+        last_low = min(last_low, low[bar])
+
+    boxes = [(kind, x0, last_idx, y0, y1, colour, width)
+             for kind, x0, _, y0, y1, colour, width in short_boxes + long_boxes]
+    return (boxes + bos_lines + pd_lines,
+            np.array(colour_modes, dtype=np.uint8), np.array(bos_candles, dtype=np.bool_))
+
+
+def _result_tuples(result):
+    """Returns engine IndicatorResult in the reference output format."""
+    shapes = []
+    for kind, x0, x1, y0, y1, style_id in zip(result.kind, result.x0, result.x1, result.y0, result.y1, result.style):
+        _, colour, width = result.styles[style_id][:3]
+        shapes.append(('box' if kind == ShapeStore.BOX else 'line', int(x0), int(x1), float(y0), float(y1),
+                       colour, width))
+    return shapes, result.candle_colour_mode, result.bos_candle
+
+
+def loop_engine(data, candle_range: int, extras=ALL_EXTRAS, skip_oldest_box: bool = True):
+    """CustomTradeIndicator over whole history at once."""
+    indicator = CustomTradeIndicator(None, data, skip_oldest_box)
+    return _result_tuples(indicator.compute(candle_range, list(extras)))
+
+
+def streaming_engine(data, candle_range: int, extras=ALL_EXTRAS, skip_oldest_box: bool = True):
+    """CustomTradeIndicator over the first third of history, then push_bar() for the rest."""
+    size = len(data['close'])
+    history = max(1, size // 3)
+    indicator = CustomTradeIndicator(None, {column: data[column][:history] for column in data}, skip_oldest_box)
+    indicator.compute(candle_range, list(extras))
+    for bar in range(history, size):
+        indicator.push_bar({column: data[column][bar] for column in ('date', 'open', 'high', 'low', 'close')})
+    return _result_tuples(indicator.result())
+
+
+def kernel_engine(data, candle_range: int, extras=ALL_EXTRAS, skip_oldest_box: bool = True):
+    """utils.kernel single loop over arrays."""
+    return _result_tuples(kernel.compute(data, candle_range, extras, skip_oldest_box))
+
+
+# engines, that must give the same output as reference_indicator()
+ENGINES = {
+    'loop': loop_engine,
+    'streaming': streaming_engine,
+    'kernel': kernel_engine,
+}
+
+
+def first_difference(expected, actual):
+    """Returns description of the first difference between two outputs, or None if they are equal."""
+    expected_shapes, expected_modes, expected_bos = expected
+    shapes, modes, bos = actual
+    for index, (expected_shape, shape) in enumerate(zip(expected_shapes, shapes)):
+        if expected_shape != shape:
+            return f'shape {index}: expected {expected_shape}, got {shape}'
+    if len(expected_shapes) != len(shapes):
+        return f'expected {len(expected_shapes)} shapes, got {len(shapes)}'
+    for name, expected_values, values in (('candle colour mode', expected_modes, modes),
+                                          ('BOS candle', expected_bos, bos)):
+        if len(expected_values) != len(values):
+            return f'{name}: expected {len(expected_values)} bars, got {len(values)}'
+        mismatches = np.flatnonzero(np.asarray(expected_values) != np.asarray(values))
+        if len(mismatches):
+            return f'{name} differs first on bar {mismatches[0]}'
+    return None
+
+
+def generate_case(rng: random.Random) -> tuple:
+    """Returns (description, data) of random series, biased to edge cases."""
+    kind = rng.choice(('walk', 'walk', 'flat', 'ties', 'gaps', 'tiny', 'intraday'))
+    bars = rng.randint(1, 5) if kind == 'tiny' else rng.randint(2, 1500)
+    seed = rng.randrange(2 ** 31)
+    data = random_walk_ohlcv(bars, seed, step=rng.choice(('m', 'h', 'D')))
+    if kind == 'flat':
+        # bars with open == high == low == close, equal prices repeating
+        price = np.round(data['close'], 0)
+        data.update(open=price, high=price, low=price, close=price)
+    elif kind == 'ties':
+        for column in ('open', 'high', 'low', 'close'):
+            data[column] = np.round(data[column], 0)
+    elif kind == 'gaps':
+        jumps = np.exp(np.cumsum(np.where(np.random.default_rng(seed).random(bars) < 0.05, 0.2, 0)
+                                 * np.random.default_rng(seed + 1).choice((-1, 1), bars)))
+        for column in ('open', 'high', 'low', 'close'):
+            data[column] = data[column] * jumps
+    elif kind == 'intraday':
+        # string dates with many bars per day, as in csv files
+        dates = pd.Series(data['timestamp']).dt.strftime('%Y-%m-%d').to_numpy()
+        data = {column: values for column, values in data.items() if column != 'timestamp'}
+        data['date'] = dates
+    return f'{kind} bars={bars} seed={seed}', data
+
+
+def run_equivalence(cases: int = 1000, seed: int = 0, engines=None, dataset: str = 'data/ohlcv.csv',
+                    progress=None, skip_oldest_box: bool = None) -> list:
+    """Compares engines with reference on dataset and on generated cases.
+     skip_oldest_box is random per generated case (mostly True) if None, the same for all cases otherwise.
+     Returns list of (case description, engine name, difference) of failures."""
+    engines = engines or ENGINES
+    rng = random.Random(seed)
+    failures = []
+    checks = []
+    if dataset:
+        data = normalize_columns(pd.read_csv(dataset))
+        data = {column: data[column].to_numpy() for column in ('date', 'open', 'high', 'low', 'close')}
+        dataset_skip = True if skip_oldest_box is None else skip_oldest_box
+        checks += [(f'{dataset} candle_range={candle_range} skip_oldest_box={dataset_skip}', data, candle_range,
+                    ALL_EXTRAS, dataset_skip) for candle_range in (5, 15, 40, 100)]
+    for _ in range(cases):
+        description, data = generate_case(rng)
+        candle_range = rng.randint(1, 120)
+        extras = tuple(flag for flag in ALL_EXTRAS if rng.random() < 0.7)
+        skip = rng.random() < 0.8
+        if skip_oldest_box is not None:
+            skip = skip_oldest_box
+        checks.append((f'{description} candle_range={candle_range} extras={extras} '
+                       f'skip_oldest_box={skip}', data, candle_range, extras, skip))
+
+    for done, (description, data, candle_range, extras, skip) in enumerate(checks, 1):
+        expected = reference_indicator(data, candle_range, extras, skip)
+        for name, engine in engines.items():
+            difference = first_difference(expected, engine(data, candle_range, extras, skip))
+            if difference:
+                failures.append((description, name, difference))
+        if progress:
+            progress(done, len(checks), len(failures))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare indicator engines with frozen reference loop.')
+    parser.add_argument('--cases', type=int, default=1000, help='number of generated series (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--dataset', default='data/ohlcv.csv', help="csv file to check too, '' to skip it")
+    args = parser.parse_args(argv)
+
+    def progress(done, total, failed):
+        print(f'\r{done}/{total} checked, {failed} failed', end='', file=sys.stderr)
+
+    failures = run_equivalence(args.cases, args.seed, {name: ENGINES[name] for name in args.engines},
+                               args.dataset, progress)
+    print(file=sys.stderr)
+    for description, name, difference in failures:
+        print(f'{name}: {description}: {difference}')
+    if failures:
+        sys.exit(1)
+    print('all engines match reference')
+
+
+if __name__ == '__main__':
+    main()
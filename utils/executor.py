@@ -0,0 +1,158 @@
+"""Background execution of indicator computations for the app. Heavy work runs in worker processes,
+so slow computation doesn't block the web server, and concurrent users don't serialize on the GIL.
+Identical in-flight requests share one computation, stale requests of a client are cancelled or dropped."""
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from threading import RLock
+
+from utils.datasets import DatasetStore
+from utils.metrics import metrics
+from utils.store import ResultStore
+from utils.viewport import ShapeIndex
+
+_worker_datasets = None
+_worker_results = None
+
+
+class Superseded(Exception):
+    """Raised when client has sent a newer request, while this one was computed or waiting."""
+
+
+class CoalescingExecutor:
+    """Wraps concurrent.futures executor. Requests are keyed: request with the same key as one in flight
+     joins its future instead of computing again. Each client has one latest request: a newer one
+     cancels the previous computation, if it has not started and nobody else waits for it.
+     If cache (ResultCache) is given, every finished result is put there, including superseded ones.
+     on_result(value) is called once per finished computation, however many requests waited for it."""
+    def __init__(self, executor, cache=None, max_clients: int = 1024, on_result=None):
+        self.executor = executor
+        self.cache = cache
+        self.on_result = on_result
+        self.max_clients = max_clients
+        self._in_flight = {}  # key -> (future, set of waiting clients)
+        self._latest = OrderedDict()  # client -> key of its latest request
+        self._lock = RLock()
+        # set, when a worker process died: the pool fails every task since then and has to be replaced
+        self.broken = False
+
+    def mark_latest(self, client, key):
+        """Marks key as the latest request of client, releasing its previous one. Call it also for requests,
+         that are answered without computation (e.g. from cache), so older computations of client are superseded."""
+        with self._lock:
+            previous = self._latest.pop(client, None)
+            self._latest[client] = key
+            if len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+            if previous is not None and previous != key:
+                self._release(previous, client)
+
+    def submit(self, key, client, function, *args):
+        """Returns future of function(*args) for key, shared with other requests of the same key in flight.
+         Marks key as the latest request of client."""
+        with self._lock:
+            self.mark_latest(client, key)
+            entry = self._in_flight.get(key)
+            if entry is None or entry[0].cancelled():
+                try:
+                    future = self.executor.submit(function, *args)
+                except BrokenProcessPool:
+                    self._broke()
+                    raise
+                entry = self._in_flight[key] = (future, set())
+                future.add_done_callback(lambda done, key=key: self._forget(key, done))
+            else:
+                metrics.incr('executor_coalesced')
+            entry[1].add(client)
+            return entry[0]
+
+    def result(self, key, client, function, *args):
+        """Waits for result of function(*args) for key. Raises Superseded, if client has sent a newer request
+         meanwhile, so its stale result is not shown. Raises BrokenProcessPool, if a worker process died,
+         then executor is broken and has to be replaced."""
+        future = self.submit(key, client, function, *args)
+        try:
+            value = future.result()
+        except CancelledError:
+            raise Superseded(key)
+        except BrokenProcessPool:
+            self._broke()
+            raise
+        finally:
+            with self._lock:
+                entry = self._in_flight.get(key)
+                if entry is not None and entry[0] is future:
+                    entry[1].discard(client)
+        if not self.is_latest(client, key):
+            metrics.incr('executor_superseded')
+            raise Superseded(key)
+        return value
+
+    def is_latest(self, client, key) -> bool:
+        with self._lock:
+            return self._latest.get(client) == key
+
+    def _release(self, key, client):
+        # client doesn't wait for key anymore, cancel computation if nobody does
+        entry = self._in_flight.get(key)
+        if entry is None:
+            return
+        entry[1].discard(client)
+        if not entry[1] and entry[0].cancel():
+            metrics.incr('executor_cancelled')
+
+    def _broke(self):
+        # futures of broken pool are all failed already, none of them can be joined by new requests
+        with self._lock:
+            self.broken = True
+            self._in_flight.clear()
+
+    def _forget(self, key, future):
+        if not future.cancelled() and future.exception() is None:
+            if self.on_result is not None:
+                self.on_result(future.result())
+            if self.cache is not None:
+                self.cache.put(key, future.result())
+        with self._lock:
+            entry = self._in_flight.get(key)
+            if entry is not None and entry[0] is future:
+                del self._in_flight[key]
+
+    def __len__(self):
+        """Returns number of requests in flight."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait, cancel_futures=True)
+
+
+def init_worker(sources: dict, cache_dir: str = 'data/.cache', results_dir: str = 'data/.results'):
+    """Worker process initializer: opens datasets from the same binary cache, as the app uses,
+     and the persistent store of computed results."""
+    global _worker_datasets, _worker_results
+    _worker_datasets = DatasetStore(sources, cache_dir)
+    _worker_results = ResultStore(results_dir)
+
+
+def compute_shape_index(source: str, candle_range: int, extras) -> ShapeIndex:
+    """Worker task: brings stored indicator results of source up to date, computing only new bars,
+     and returns their shapes index. Counters of the work go back with it in ShapeIndex.stats,
+     as metrics of worker processes are not scraped."""
+    dataset = _worker_datasets.get(source)
+    stats = {}
+    result = _worker_results.update(source, dataset, candle_range, extras, fingerprint=dataset.fingerprint,
+                                    stats=stats)
+    return ShapeIndex(result, stats)
+
+
+def record_stats(shape_index: ShapeIndex):
+    """Adds counters of worker computation of shape_index to the app metrics."""
+    stats = shape_index.stats
+    if not stats:
+        return
+    if stats['bars_processed']:
+        metrics.observe('indicator_update', stats['seconds'])
+    metrics.incr('indicator_bars_processed', stats['bars_processed'])
+    metrics.incr('indicator_boxes_created', stats['boxes_created'])
+    metrics.incr('indicator_boxes_removed', stats['boxes_removed'])
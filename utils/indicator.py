@@ -1,9 +1,120 @@
-import pandas as pd
-from utils.builtins import TradeView
+import heapq
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
+
+import numpy as np
+from utils import render
+from utils.builtins import ShapeStore, TradeView
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class IndicatorResult:
+    """Plain arrays, computed by CustomTradeIndicator.compute(), without any plotly objects.
+     Shapes are in drawing order: short boxes, long boxes, BOS lines, PDH/PDL lines."""
+    x0: np.ndarray  # int32 left bar index
+    x1: np.ndarray  # int32 right bar index
+    y0: np.ndarray  # float64 price
+    y1: np.ndarray  # float64 price
+    kind: np.ndarray  # uint8 ShapeStore.BOX or ShapeStore.LINE
+    style: np.ndarray  # uint16 index of styles
+    styles: list  # (kind, colour, width, xref, yref)
+    candle_colour_mode: np.ndarray  # uint8 per bar, 0 - bearish, 1 - bullish
+    bos_candle: np.ndarray  # bool per bar, True since the first break of structure
+    candle_colours: tuple = ('red', 'lime', 'yellow')  # bearish, bullish, BOS candle colours
+
+    def __len__(self):
+        return len(self.x0)
+
+    def take(self, rows) -> 'IndicatorResult':
+        """Returns result with only shapes at rows (indices or mask), keeping candle colouring."""
+        return replace(self, x0=self.x0[rows], x1=self.x1[rows], y0=self.y0[rows], y1=self.y1[rows],
+                       kind=self.kind[rows], style=self.style[rows])
+
+    @property
+    def boxes(self):
+        """Returns mask of order block shapes."""
+        return self.kind == ShapeStore.BOX
+
+    @property
+    def lines(self):
+        """Returns mask of line shapes."""
+        return self.kind == ShapeStore.LINE
+
+    @property
+    def candle_colour(self):
+        """Returns increasing candles fill colour on the last bar, or None if no bars were processed."""
+        if not len(self.candle_colour_mode):
+            return None
+        if self.bos_candle[-1]:
+            return self.candle_colours[2]
+        return self.candle_colours[self.candle_colour_mode[-1]]
+
+
+class ActiveBoxes:
+    """Order boxes, that are still on chart, in creation order, with heap sorted by the mitigation edge.
+     edge='top' mitigates boxes, when price goes above their top, edge='bottom' - below their bottom.
+     Each bar pops only boxes, that price actually crossed, instead of scanning all live boxes.
+     skip_oldest keeps the oldest live box from mitigation, like the original loops,
+     that stopped before index 0 of boxes array."""
+    def __init__(self, edge: str = 'top', skip_oldest: bool = True):
+        self.edge = edge
+        self.skip_oldest = skip_oldest
+        self._boxes = {}  # creation number -> box, in creation order
+        self._order = deque()  # creation numbers, mitigated ones are dropped lazily from the left
+        self._heap = []  # (edge price, creation number), price is negated for the bottom edge
+        self._count: int = 0
+
+    def append(self, box):
+        number = self._count
+        self._count += 1
+        self._boxes[number] = box
+        self._order.append(number)
+        price = box.get_top if self.edge == 'top' else -box.get_bottom
+        heapq.heappush(self._heap, (price, number))
+
+    def pop_crossed(self, price: float) -> list:
+        """Removes and returns boxes, that price crossed beyond their edge, the newest first."""
+        heap = self._heap
+        price = price if self.edge == 'top' else -price
+        if not heap or not heap[0][0] < price:
+            return []
+        oldest = self._oldest() if self.skip_oldest else None
+        crossed = []
+        skipped = None
+        while heap and heap[0][0] < price:
+            item = heapq.heappop(heap)
+            if item[1] == oldest:
+                skipped = item
+            else:
+                crossed.append(item[1])
+        if skipped:
+            heapq.heappush(heap, skipped)
+        crossed.sort(reverse=True)
+        return [self._boxes.pop(number) for number in crossed]
+
+    def _oldest(self):
+        """Returns creation number of the oldest live box."""
+        order = self._order
+        while order[0] not in self._boxes:
+            order.popleft()
+        return order[0]
+
+    def __iter__(self):
+        return iter(self._boxes.values())
+
+    def __len__(self):
+        return len(self._boxes)
 
 
 class CustomTradeIndicator:
-    def __init__(self, figure, dataframe: pd.DataFrame):
+    def __init__(self, figure, dataframe: 'pd.DataFrame', skip_oldest_box: bool = True):
+        """Creates indicator over dataframe. figure is used only by draw_indicator(),
+         pass None to run headless with compute()."""
         self.fig = figure
         self.df = dataframe
         self.tv = TradeView(dataframe)
@@ -18,9 +129,11 @@ class CustomTradeIndicator:
         self.bullish_trend_color = 'lime'
         self.bearish_trend_colour = 'red'
 
-        # candle colouring
+        # candle colouring, also recorded per bar
         self.candle_colour_mode: int = 0
         self.bos_candle: bool = False
+        self.candle_colour_modes = bytearray()
+        self.bos_candles = bytearray()
 
         # tracking for entries
         self.last_down_index: int = 0
@@ -39,8 +152,9 @@ class CustomTradeIndicator:
         self.structure_low: float = 1000000
 
         # order block drawing arrays
-        self.long_boxes = []
-        self.short_boxes = []
+        # skip_oldest_box keeps the oldest live box from mitigation, as in the original script port
+        self.long_boxes = ActiveBoxes('bottom', skip_oldest_box)
+        self.short_boxes = ActiveBoxes('top', skip_oldest_box)
         self.bos_lines = []
         self.PDH_line = None
         self.PDL_line = None
@@ -48,191 +162,248 @@ class CustomTradeIndicator:
         self.last_long_index: int = 0
         self.last_short_index: int = 0
 
+        # streaming: index of the last processed bar and shapes changed by the last update()
+        self._last_processed_idx: int = -1
+        self.added_shapes = []
+        self.removed_shapes = []
+
     def structure_low_index_pointer(self, length):
         min_value = self.tv.highest(self.tv.high(), self.candle_range, 1)
-        min_index = self.tv.bar_index()
-        for i in range(1, length + 1):
-            if self.tv.low(i) < min_value:
-                min_value = self.tv.low(i)
-                min_index = self.tv.bar_index(i)
+        # the same bars as low(1)...low(length), the latest bar wins ties
+        min_index = self.tv.lowest_index(length - 1, 1)
+        if min_index is None or not self.tv.low(self.tv.bar_index() - min_index) < min_value:
+            return self.tv.bar_index()
         return min_index
 
-    def draw_indicator(self, candle_range: int = None, extras: list = None):
+    def draw_indicator(self, candle_range: int = None, extras: list = None, render_mode: str = 'shapes'):
+        """Computes indicator and draws it on figure once.
+         render_mode='shapes' adds plotly layout shape per element,
+         render_mode='traces' packs elements into few scatter traces, that is much faster on long histories."""
+        render.render(self.fig, self.compute(candle_range, extras), self.tv.dates, render_mode)
+
+    def compute(self, candle_range: int = None, extras: list = None) -> IndicatorResult:
+        """Runs indicator over all bars, that were not processed yet. Doesn't touch figure."""
         self.candle_range = candle_range or self.candle_range
         if extras:
             self.show_PD = 'showPD' in extras
             self.show_bearish_BOS = 'showBearishBOS' in extras
             self.show_bullish_BOS = 'showBullishBOS' in extras
 
-        # Main logic cycle. Calculates Plotly graphic shapes from trading dataframe, then filters it.
-        while True:
-            bar_index = self.tv.bar_index()
-            low_ = self.tv.low()
-            high_ = self.tv.high()
-            close_ = self.tv.close()
-            open_ = self.tv.open()
-
-            if self.show_PD:
-                # check only the last bars to speed up
-                if bar_index >= self.tv.last_idx - 20:
-                    PDH = self.tv.security('', 'D', self.tv.high, 1)
-                    PDL = self.tv.security('', 'D', self.tv.low, 1)
-                    if PDH:
-                        del self.PDH_line
-                        del self.PDL_line
-
-                        self.PDH_line = self.tv.new_line(
-                            x0=0,
+        self.update()
+        return self.result()
+
+    def elements(self):
+        """Returns list of filtered Box and Line elements, that are still on chart."""
+        elements_to_render = [
+            *self.short_boxes,
+            *self.long_boxes,
+            *self.bos_lines,
+        ]
+        if self.PDH_line:
+            elements_to_render.append(self.PDH_line)
+            elements_to_render.append(self.PDL_line)
+        return elements_to_render
+
+    def result(self) -> IndicatorResult:
+        """Returns arrays of filtered elements and per bar candle colouring of bars processed so far."""
+        store = self.tv.shape_store
+        columns = store.columns()
+        rows = np.fromiter((element.row for element in self.elements()), dtype=np.int64)
+        x1 = columns['x1'][rows]
+        x1[x1 == store.LAST_BAR] = self.tv.last_idx
+        return IndicatorResult(
+            x0=columns['x0'][rows],
+            x1=x1,
+            y0=columns['y0'][rows],
+            y1=columns['y1'][rows],
+            kind=columns['kind'][rows],
+            style=columns['style'][rows],
+            styles=list(store.styles),
+            candle_colour_mode=np.frombuffer(bytes(self.candle_colour_modes), dtype=np.uint8),
+            bos_candle=np.frombuffer(bytes(self.bos_candles), dtype=np.bool_),
+            candle_colours=(self.bearish_trend_colour, self.bullish_trend_color, self.BOS_candle_colour),
+        )
+
+    def shapes(self):
+        """Returns list of plotly shape dicts of filtered elements, that are still on chart."""
+        return render.shapes(self.result(), self.tv.dates)
+
+    def shape_traces(self):
+        """Returns filtered elements packed into one go.Scatter per style (colour and width)."""
+        return render.shape_traces(self.result(), self.tv.dates)
+
+    def push_bar(self, ohlcv):
+        """Appends new bar (mapping with date, open, high, low, close) and processes it,
+         continuing from the state left by previous bars. Returns (added, removed) lists of shapes,
+         that changed since the previous call. Apply added first, then removed."""
+        self.tv.append_bar(ohlcv)
+        return self.update()
+
+    def update(self):
+        """Processes all bars, that were not processed yet. Returns (added, removed) lists of shapes."""
+        self.added_shapes = []
+        self.removed_shapes = []
+        first_idx = self._last_processed_idx
+        with metrics.timer('indicator_update'):
+            while True:
+                if self._last_processed_idx == self.tv.bar_index():
+                    # if there's no bars to handle - exit cycle
+                    if not self.tv.step_forward:
+                        break
+                self.process_bar()
+                self._last_processed_idx = self.tv.bar_index()
+        metrics.incr('indicator_bars_processed', self._last_processed_idx - first_idx)
+        metrics.incr('indicator_boxes_created', sum(isinstance(shape, TradeView.Box) for shape in self.added_shapes))
+        metrics.incr('indicator_boxes_removed',
+                     sum(isinstance(shape, TradeView.Box) for shape in self.removed_shapes))
+        return self.added_shapes, self.removed_shapes
+
+    def process_bar(self):
+        """Main logic of one bar. Calculates Plotly graphic shapes from trading dataframe, then filters it."""
+        bar_index = self.tv.bar_index()
+        low_ = self.tv.low()
+        high_ = self.tv.high()
+        close_ = self.tv.close()
+        open_ = self.tv.open()
+
+        if self.show_PD:
+            PDH = self.tv.security('', 'D', self.tv.high, 1)
+            PDL = self.tv.security('', 'D', self.tv.low, 1)
+            if PDH:
+                if self.PDH_line:
+                    self.removed_shapes.extend((self.PDH_line, self.PDL_line))
+                del self.PDH_line
+                del self.PDL_line
+
+                self.PDH_line = self.tv.new_line(
+                    x0=0,
+                    x1=bar_index,
+                    y0=PDH,
+                    y1=PDH,
+                    xref='x',
+                    yref='y',
+                    color="LightBlue",
+                    width=1
+                )
+                self.PDL_line = self.tv.new_line(
+                    x0=0,
+                    x1=bar_index,
+                    y0=PDL,
+                    y1=PDL,
+                    xref='x',
+                    yref='y',
+                    color="LightBlue",
+                    width=1
+                )
+                self.added_shapes.extend((self.PDH_line, self.PDL_line))
+
+        # get the lowest point in the range
+        self.structure_low = self.tv.lowest(low_, self.candle_range, 1)
+        self.structure_low_index = self.structure_low_index_pointer(self.candle_range)
+        # bearish break of structure
+        if self.tv.crossunder(self.tv.low, self.structure_low):
+            if (bar_index - self.last_up_index) < 1000:
+                # add bear order block
+                short_box = self.tv.new_box(
+                    x0=self.last_up_index,
+                    x1=None,
+                    y0=self.last_up_low,
+                    y1=self.last_high,
+                    xref='x',
+                    yref='y',
+                    line_width=0,
+                    fillcolor=self.bearish_OB_colour
+                )
+                self.short_boxes.append(short_box)
+                self.added_shapes.append(short_box)
+                # add bearish bos line
+                if self.show_bearish_BOS:
+                    self.bos_lines.append(
+                        self.tv.new_line(
+                            x0=self.structure_low_index,
                             x1=bar_index,
-                            y0=PDH,
-                            y1=PDH,
+                            y0=self.structure_low,
+                            y1=self.structure_low,
                             xref='x',
                             yref='y',
-                            color="LightBlue",
-                            width=1
+                            color="Red",
+                            width=2
                         )
-                        self.PDL_line = self.tv.new_line(
-                            x0=0,
+                    )
+                    self.added_shapes.append(self.bos_lines[-1])
+
+                # show bos candle
+                self.bos_candle = True
+                # color mode bear
+                self.candle_colour_mode = 0
+                self.last_short_index = self.last_up_index
+
+        # bullish break of structure?
+        # short boxes, that close crossed, the newest first
+        crossed_boxes = self.short_boxes.pop_crossed(close_)
+        if crossed_boxes:
+            # remove the short boxes
+            self.removed_shapes.extend(crossed_boxes)
+            top = crossed_boxes[0].get_top
+            left = crossed_boxes[0].get_left
+            # ok to draw?
+            if (bar_index - self.last_down_index) < 1000 and bar_index > self.last_long_index:
+                # add bullish order block
+                long_box = self.tv.new_box(
+                    x0=self.last_down_index,
+                    x1=None,
+                    y0=self.last_low,
+                    y1=self.last_down,
+                    xref='x',
+                    yref='y',
+                    line_width=0,
+                    fillcolor=self.bullish_OB_colour
+                )
+                self.long_boxes.append(long_box)
+                self.added_shapes.append(long_box)
+                if self.show_bullish_BOS:
+                    self.bos_lines.append(
+                        self.tv.new_line(
+                            x0=left,
                             x1=bar_index,
-                            y0=PDL,
-                            y1=PDL,
+                            y0=top,
+                            y1=top,
                             xref='x',
                             yref='y',
-                            color="LightBlue",
-                            width=1
+                            color="Green",
+                            width=2
                         )
+                    )
+                    self.added_shapes.append(self.bos_lines[-1])
+                # show bos candle
+                self.bos_candle = True
+                # color mode bullish
+                self.candle_colour_mode = 1
+                # record last bull bar index to prevent duplication
+                self.last_long_index = bar_index
+                self.last_bull_break_low = low_
 
+        # remove LL if close below
+        self.removed_shapes.extend(self.long_boxes.pop_crossed(close_))
 
+        self.candle_colour_modes.append(self.candle_colour_mode)
+        self.bos_candles.append(self.bos_candle)
 
+        # record last up and down candles
+        if close_ < open_:
+            self.last_down = high_
+            self.last_down_index = bar_index
+            self.last_low = low_
 
-            # get the lowest point in the range
-            self.structure_low = self.tv.lowest(low_, self.candle_range, 1)
-            self.structure_low_index = self.structure_low_index_pointer(self.candle_range)
-            # bearish break of structure
-            if self.tv.crossunder(self.tv.low, self.structure_low):
-                if (bar_index - self.last_up_index) < 1000:
-                    # add bear order block
-                    self.short_boxes.append(
-                        self.tv.new_box(
-                            x0=self.last_up_index,
-                            x1=self.tv.last_idx,
-                            y0=self.last_up_low,
-                            y1=self.last_high,
-                            xref='x',
-                            yref='y',
-                            line_width=0,
-                            fillcolor=self.bearish_OB_colour
-                        )
-                    )
-                    # add bearish bos line
-                    if self.show_bearish_BOS:
-                        self.bos_lines.append(
-                            self.tv.new_line(
-                                x0=self.structure_low_index,
-                                x1=bar_index,
-                                y0=self.structure_low,
-                                y1=self.structure_low,
-                                xref='x',
-                                yref='y',
-                                color="Red",
-                                width=2
-                            )
-                        )
+        if close_ > open_:
+            self.last_up = close_
+            self.last_up_index = bar_index
+            self.last_up_open = open_
+            self.last_up_low = low_
+            self.last_high = high_
 
-                    # show bos candle
-                    self.bos_candle = True
-                    # color mode bear
-                    self.candle_colour_mode = 0
-                    self.last_short_index = self.last_up_index
-
-            # bullish break of structure?
-            if self.short_boxes:
-                for i in range(len(self.short_boxes) - 1, 0, -1):
-                    box = self.short_boxes[i]
-                    top = box.get_top
-                    left = box.get_left
-                    if close_ > top:
-                        # remove the short box
-                        del self.short_boxes[i]
-                        # ok to draw?
-                        if (bar_index - self.last_down_index) < 1000 and bar_index > self.last_long_index:
-                            # add bullish order block
-                            self.long_boxes.append(
-                                self.tv.new_box(
-                                    x0=self.last_down_index,
-                                    x1=self.tv.last_idx,
-                                    y0=self.last_low,
-                                    y1=self.last_down,
-                                    xref='x',
-                                    yref='y',
-                                    line_width=0,
-                                    fillcolor=self.bullish_OB_colour
-                                )
-                            )
-                            if self.show_bullish_BOS:
-                                self.bos_lines.append(
-                                    self.tv.new_line(
-                                        x0=left,
-                                        x1=bar_index,
-                                        y0=top,
-                                        y1=top,
-                                        xref='x',
-                                        yref='y',
-                                        color="Green",
-                                        width=2
-                                    )
-                                )
-                            # show bos candle
-                            self.bos_candle = True
-                            # color mode bullish
-                            self.candle_colour_mode = 1
-                            # record last bull bar index to prevent duplication
-                            self.last_long_index = bar_index
-                            self.last_bull_break_low = low_
-
-            # remove LL if close below
-            if self.long_boxes:
-                for i in range(len(self.long_boxes) - 1, 0, -1):
-                    lbox = self.long_boxes[i]
-                    bottom = lbox.get_bottom
-                    if close_ < bottom:
-                        del self.long_boxes[i]
-
-            candle_color = self.bullish_trend_color if self.candle_colour_mode else self.bearish_trend_colour
-            candle_color = self.BOS_candle_colour if self.bos_candle else candle_color
-            self.fig.data[0].increasing.fillcolor = candle_color
-
-            # record last up and down candles
-            if close_ < open_:
-                self.last_down = high_
-                self.last_down_index = bar_index
-                self.last_low = low_
-
-            if close_ > open_:
-                self.last_up = close_
-                self.last_up_index = bar_index
-                self.last_up_open = open_
-                self.last_up_low = low_
-                self.last_high = high_
-
-            # update last high / low for more accurate order block placements
-            if high_ > self.last_high:
-                self.last_high = high_
-            if low_ < self.last_low:
-                self.last_low = low_
-
-            # if there's no bars to handle - exit cycle
-            if not self.tv.step_forward:
-                break
-
-        elements_to_render = [
-            *self.short_boxes,
-            *self.long_boxes,
-            *self.bos_lines,
-        ]
-        if self.PDH_line:
-            elements_to_render.append(self.PDH_line)
-            elements_to_render.append(self.PDL_line)
-        # draw filtered shapes
-        for element in elements_to_render:
-            self.fig.add_shape(element.shape)
+        # update last high / low for more accurate order block placements
+        if high_ > self.last_high:
+            self.last_high = high_
+        if low_ < self.last_low:
+            self.last_low = low_
@@ -0,0 +1,271 @@
+"""The same state machine, as CustomTradeIndicator runs, in one function over plain arrays.
+No TradeView, no shape objects, no method calls per bar: only local ints, floats, lists and heaps.
+Engine state after the last bar is kept in picklable KernelState, so the next run over the same, but longer,
+columns processes only new bars. CustomTradeIndicator is still needed for bar by bar streaming with push_bar()."""
+from dataclasses import dataclass, field
+from heapq import heappop, heappush
+
+import numpy as np
+
+from utils.builtins import ShapeStore, rolling_min, shift, timeframe_keys, timestamps_of
+from utils.indicator import IndicatorResult
+
+BEARISH_OB_COLOUR = 'rgba(255,0,0,0.14)'
+BULLISH_OB_COLOUR = 'rgba(0,255,0,0.14)'
+# style ids of result, in the same (kind, colour, width, xref, yref) format, as ShapeStore.styles
+STYLES = [
+    ('box', BEARISH_OB_COLOUR, 0, 'x', 'y'),
+    ('box', BULLISH_OB_COLOUR, 0, 'x', 'y'),
+    ('line', 'Red', 2, 'x', 'y'),
+    ('line', 'Green', 2, 'x', 'y'),
+    ('line', 'LightBlue', 1, 'x', 'y'),
+]
+SHORT_BOX, LONG_BOX, BEARISH_BOS, BULLISH_BOS, PD_LINE = range(len(STYLES))
+# order blocks are drawn only from up/down candles, that are closer than that to the break of structure
+MAX_BLOCK_AGE = 1000
+
+
+@dataclass
+class KernelState:
+    """State of kernel after the first `bars` bars. Live boxes are in heaps by mitigation edge,
+     boxes are numbered in creation order of both sides together."""
+    bars: int = 0
+    boxes: int = 0
+    short_boxes: int = 0
+    long_boxes: int = 0
+    short_heap: list = field(default_factory=list)  # (top, box number)
+    long_heap: list = field(default_factory=list)  # (-bottom, box number)
+    short_live: dict = field(default_factory=dict)  # box number -> (x0, top) of live short boxes
+    last_long_index: int = 0
+    colour_mode: int = 0
+    bos_candle: bool = False
+    pd_line: tuple = None  # (bar, previous day high, previous day low) of the last PDH/PDL lines
+
+
+def run_kernel(open_, high, low, close, timestamps, candle_range: int = 15, show_pd: bool = False,
+               show_bearish_bos: bool = False, show_bullish_bos: bool = False, skip_oldest_box: bool = True,
+               state: KernelState = None) -> tuple:
+    """Runs indicator over bars after state.bars (all bars without state). Columns must hold the same bars,
+     as the run, that returned state, plus new ones. Returns (events, new state). Events are dict of arrays:
+     box_bar, box_side (SHORT_BOX/LONG_BOX), box_x0, box_y0, box_y1 of boxes created on new bars,
+     mitigated_box, mitigated_bar of boxes removed on new bars, line_x0, line_x1, line_y, line_style of BOS lines,
+     candle_colour_mode and bos_candle of new bars.
+     Everything, that doesn't depend on live boxes, is computed with numpy in advance, only over new bars and
+     a few bars before them, so the loop over bars only compares close with the nearest box edges."""
+    if candle_range < 1:
+        raise ValueError(f'candle_range must be positive, got {candle_range}')
+    state = state or KernelState()
+    size = len(close)
+    start = state.bars
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    # bars before new ones, that are still looked at: order block age, structure window, the previous day
+    offset = max(0, start - MAX_BLOCK_AGE - candle_range - 2)
+    if start:
+        offset = min(offset, int(np.searchsorted(timestamps, timestamps[start - 1].astype('datetime64[D]'))))
+    open_, high, low, close = (np.ascontiguousarray(values[offset:size], dtype=np.float64)
+                               for values in (open_, high, low, close))
+    day_keys = timeframe_keys(timestamps[offset:size], 'D')
+    count = size - offset
+    bars = np.arange(count)
+
+    # last up and down candles before each bar: index or -1. Truncated history only misses
+    # candles older than MAX_BLOCK_AGE, that can't give order block anyway
+    up_before = np.full(count, -1, dtype=np.int64)
+    down_before = np.full(count, -1, dtype=np.int64)
+    up_before[1:] = np.maximum.accumulate(np.where(close > open_, bars, -1))[:-1]
+    down_before[1:] = np.maximum.accumulate(np.where(close < open_, bars, -1))[:-1]
+
+    # lowest low of bars [i - 1 - candle_range, i), bearish break of structure is low crossing under it
+    structure_lows = shift(rolling_min(low, candle_range + 1, min_periods=1), 1, fill=np.inf)
+    previous_lows = np.concatenate((low[:1], low[:-1]))
+    bearish = (low < structure_lows) & (structure_lows < previous_lows)
+    bearish &= bars + offset - np.maximum(up_before + offset, 0) < MAX_BLOCK_AGE
+    bearish[:start - offset] = False
+
+    high, low, close = high.tolist(), low.tolist(), close.tolist()
+    up_before, down_before = up_before.tolist(), down_before.tolist()
+    structure_lows = structure_lows.tolist()
+
+    box_bar, box_side, box_x0, box_y0, box_y1 = [], [], [], [], []
+    mitigated_box, mitigated_bar = [], []
+    line_x0, line_x1, line_y, line_style = [], [], [], []
+    colour_events = []  # (bar, colour mode)
+    boxes, short_boxes, long_boxes = state.boxes, state.short_boxes, state.long_boxes
+    short_heap, long_heap, short_live = list(state.short_heap), list(state.long_heap), dict(state.short_live)
+    last_long_index = state.last_long_index
+    # nearest edges of mitigatable boxes; the oldest box of each side is never mitigated with skip_oldest_box
+    short_top = short_heap[0][0] if short_heap else np.inf
+    long_bottom = -long_heap[0][0] if long_heap else -np.inf
+    next_bearish = iter(np.flatnonzero(bearish).tolist() + [count])
+    bearish_bar = next(next_bearish)
+
+    # i is index in columns from offset, bar = i + offset is bar index
+    for i in range(start - offset, count):
+        close_ = close[i]
+        if i == bearish_bar:
+            bearish_bar = next(next_bearish)
+            bar = i + offset
+            # bear order block from the last up candle
+            up = up_before[i]
+            if up >= 0:
+                last_up_index, last_up_low, last_high = up + offset, low[up], max(high[up:i])
+            else:
+                last_up_index, last_up_low, last_high = 0, 0, max(0, max(high[:i]))
+            box_bar.append(bar)
+            box_side.append(SHORT_BOX)
+            box_x0.append(last_up_index)
+            box_y0.append(last_up_low)
+            box_y1.append(last_high)
+            if short_boxes or not skip_oldest_box:
+                heappush(short_heap, (last_high, boxes))
+                short_live[boxes] = (last_up_index, last_high)
+                short_top = short_heap[0][0]
+            boxes += 1
+            short_boxes += 1
+            if show_bearish_bos:
+                window_start = max(0, i - candle_range)
+                window = low[window_start:i]
+                lowest = min(window)
+                # the latest bar wins ties
+                structure_low_index = window_start + len(window) - 1 - window[::-1].index(lowest) + offset
+                if not lowest < max(high[max(0, i - 1 - candle_range):i]):
+                    structure_low_index = bar
+                line_x0.append(structure_low_index)
+                line_x1.append(bar)
+                line_y.append(structure_lows[i])
+                line_style.append(BEARISH_BOS)
+            colour_events.append((bar, 0))
+
+        # bullish break of structure, when close goes above tops of short boxes
+        if close_ > short_top:
+            bar = i + offset
+            newest = -1
+            while short_heap and short_heap[0][0] < close_:
+                number = heappop(short_heap)[1]
+                mitigated_box.append(number)
+                mitigated_bar.append(bar)
+                broken = short_live.pop(number)
+                if number > newest:
+                    newest, (broken_left, broken_top) = number, broken
+            short_top = short_heap[0][0] if short_heap else np.inf
+            down = down_before[i]
+            last_down_index = max(down + offset, 0)
+            if bar - last_down_index < MAX_BLOCK_AGE and bar > last_long_index:
+                # bull order block from the last down candle
+                if down >= 0:
+                    last_down, last_low = high[down], min(low[down:i])
+                else:
+                    last_down, last_low = 0, min(0, min(low[:i]))
+                box_bar.append(bar)
+                box_side.append(LONG_BOX)
+                box_x0.append(last_down_index)
+                box_y0.append(last_low)
+                box_y1.append(last_down)
+                if long_boxes or not skip_oldest_box:
+                    heappush(long_heap, (-last_low, boxes))
+                    long_bottom = -long_heap[0][0]
+                boxes += 1
+                long_boxes += 1
+                if show_bullish_bos:
+                    line_x0.append(broken_left)
+                    line_x1.append(bar)
+                    line_y.append(broken_top)
+                    line_style.append(BULLISH_BOS)
+                colour_events.append((bar, 1))
+                last_long_index = bar
+
+        # long boxes are mitigated, when close goes below their bottoms
+        if close_ < long_bottom:
+            while long_heap and long_heap[0][0] < -close_:
+                mitigated_box.append(heappop(long_heap)[1])
+                mitigated_bar.append(i + offset)
+            long_bottom = -long_heap[0][0] if long_heap else -np.inf
+
+    # candle colour mode of the last event on or before each bar, BOS candle since the first event
+    new_bars = np.arange(start, size)
+    event_bars = np.array([event[0] for event in colour_events], dtype=np.int64)
+    event_modes = np.array([state.colour_mode] + [event[1] for event in colour_events], dtype=np.uint8)
+    candle_colour_modes = event_modes[np.searchsorted(event_bars, new_bars, 'right')]
+    bos_candles = np.full(size - start, state.bos_candle, dtype=np.bool_)
+    if colour_events:
+        bos_candles[event_bars[0] - start:] = True
+
+    # previous day high/low lines are redrawn on every new day, where previous day high is not zero
+    pd_line = state.pd_line
+    if show_pd:
+        day_starts = np.flatnonzero(np.diff(day_keys)) + 1
+        if len(day_starts):
+            bounds = np.concatenate(([0], day_starts))
+            day_highs = np.maximum.reduceat(np.asarray(high), bounds)[:-1]
+            day_lows = np.minimum.reduceat(np.asarray(low), bounds)[:-1]
+            drawn = np.flatnonzero(day_highs * (day_starts + offset >= start))
+            if len(drawn):
+                last = drawn[-1]
+                pd_line = (int(day_starts[last] + offset), float(day_highs[last]), float(day_lows[last]))
+
+    events = {
+        'box_bar': np.array(box_bar, dtype=np.int32),
+        'box_side': np.array(box_side, dtype=np.uint8),
+        'box_x0': np.array(box_x0, dtype=np.int32),
+        'box_y0': np.array(box_y0, dtype=np.float64),
+        'box_y1': np.array(box_y1, dtype=np.float64),
+        'mitigated_box': np.array(mitigated_box, dtype=np.int32),
+        'mitigated_bar': np.array(mitigated_bar, dtype=np.int32),
+        'line_x0': np.array(line_x0, dtype=np.int32),
+        'line_x1': np.array(line_x1, dtype=np.int32),
+        'line_y': np.array(line_y, dtype=np.float64),
+        'line_style': np.array(line_style, dtype=np.uint8),
+        'candle_colour_mode': candle_colour_modes,
+        'bos_candle': bos_candles,
+    }
+    new_state = KernelState(
+        bars=size, boxes=boxes, short_boxes=short_boxes, long_boxes=long_boxes,
+        short_heap=short_heap, long_heap=long_heap, short_live=short_live, last_long_index=last_long_index,
+        colour_mode=int(candle_colour_modes[-1]) if size > start else state.colour_mode,
+        bos_candle=bool(bos_candles[-1]) if size > start else state.bos_candle,
+        pd_line=pd_line,
+    )
+    return events, new_state
+
+
+def result_from_events(events, state: KernelState) -> IndicatorResult:
+    """Returns IndicatorResult of all bars from events of all runs (concatenated or stored) and the last state.
+     Shapes go in drawing order: live short boxes, live long boxes, BOS lines, PDH/PDL lines."""
+    last_idx = state.bars - 1
+    live = np.ones(len(events['box_bar']), dtype=np.bool_)
+    live[events['mitigated_box']] = False
+    side = events['box_side']
+    rows = np.concatenate((np.flatnonzero(live & (side == SHORT_BOX)), np.flatnonzero(live & (side == LONG_BOX))))
+    pd_count = 2 if state.pd_line else 0
+    pd_x1, pd_high, pd_low = state.pd_line or (0, 0.0, 0.0)
+    style = np.concatenate((side[rows].astype(np.uint16), np.asarray(events['line_style'], dtype=np.uint16),
+                            np.full(pd_count, PD_LINE, dtype=np.uint16)))
+    kinds = np.array([ShapeStore.BOX if style[0] == 'box' else ShapeStore.LINE for style in STYLES], dtype=np.uint8)
+    return IndicatorResult(
+        x0=np.concatenate((events['box_x0'][rows], events['line_x0'], np.zeros(pd_count, dtype=np.int32))),
+        x1=np.concatenate((np.full(len(rows), last_idx, dtype=np.int32), events['line_x1'],
+                           np.full(pd_count, pd_x1, dtype=np.int32))),
+        y0=np.concatenate((events['box_y0'][rows], events['line_y'], np.array((pd_high, pd_low)[:pd_count]))),
+        y1=np.concatenate((events['box_y1'][rows], events['line_y'], np.array((pd_high, pd_low)[:pd_count]))),
+        kind=kinds[style],
+        style=style,
+        styles=list(STYLES),
+        candle_colour_mode=np.asarray(events['candle_colour_mode']),
+        bos_candle=np.asarray(events['bos_candle']),
+    )
+
+
+def run(dataframe, candle_range: int = 15, extras=(), skip_oldest_box: bool = True, state: KernelState = None):
+    """Runs kernel over dataframe (or Dataset, or dict of arrays) with date and OHLC columns,
+     continuing from state if it is given. Returns (events, new state) of run_kernel().
+     Missing candle_range falls back to 15, as in CustomTradeIndicator, fractional one is truncated to whole bars."""
+    candle_range = int(candle_range or 15)
+    return run_kernel(dataframe['open'], dataframe['high'], dataframe['low'], dataframe['close'],
+                      timestamps_of(dataframe), candle_range, 'showPD' in extras, 'showBearishBOS' in extras,
+                      'showBullishBOS' in extras, skip_oldest_box, state)
+
+
+def compute(dataframe, candle_range: int = 15, extras=(), skip_oldest_box: bool = True) -> IndicatorResult:
+    """Runs kernel over whole dataframe (or Dataset, or dict of arrays) with date and OHLC columns.
+     Returns the same IndicatorResult, as CustomTradeIndicator(None, dataframe).compute() does."""
+    return result_from_events(*run(dataframe, candle_range, extras, skip_oldest_box))
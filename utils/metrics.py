@@ -0,0 +1,188 @@
+"""Named timers and counters of app and indicator stages, exported to logs and as Prometheus text.
+Set TRADEVIEW_PROFILE=cprofile (or pyinstrument, if installed) to log profile of every profiled block."""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+PROFILE_ENV = 'TRADEVIEW_PROFILE'
+# upper bounds in seconds of histogram buckets, from fast cached callbacks to full recompute of long history
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metrics:
+    """Thread safe registry of timers (histograms of seconds), counters, and values read by collectors on export."""
+    def __init__(self, prefix: str = 'tradeview', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._timers = {}
+        self._counters = {}
+        self._collectors = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, seconds: float):
+        """Records duration of one run of named stage."""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                # per bucket counts (last one is +Inf), count, sum, max
+                timer = self._timers[name] = [[0] * (len(self.buckets) + 1), 0, 0.0, 0.0]
+            timer[0][bisect_left(self.buckets, seconds)] += 1
+            timer[1] += 1
+            timer[2] += seconds
+            timer[3] = max(timer[3], seconds)
+
+    @contextmanager
+    def timer(self, name: str, into: dict = None):
+        """Times the block as named stage. If into dict is given, also puts elapsed seconds there by name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed)
+            if into is not None:
+                into[name] = elapsed
+            log.debug('%s took %.1f ms', name, elapsed * 1000)
+
+    def incr(self, name: str, value: int = 1):
+        """Adds value to named counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def collector(self, name: str, function, counters=()):
+        """Registers function returning dict of numbers, that are read on every export as name_key.
+         Keys in counters are monotonic totals and exported as counters, the others as gauges.
+         E.g. collector('results_cache', results_cache.stats, counters=('hits', 'misses', 'evictions'))."""
+        with self._lock:
+            self._collectors[name] = (function, frozenset(counters))
+
+    def collected(self) -> tuple:
+        """Returns (counters, gauges) dicts of values read from collectors."""
+        counters, gauges = {}, {}
+        with self._lock:
+            collectors = list(self._collectors.items())
+        for name, (function, counter_keys) in collectors:
+            for key, value in function().items():
+                (counters if key in counter_keys else gauges)[f'{name}_{key}'] = value
+        return counters, gauges
+
+    def snapshot(self) -> dict:
+        """Returns dict of timers (count, sum, max, mean in seconds), counters and gauges."""
+        with self._lock:
+            timers = {name: {'count': count, 'sum': total, 'max': longest, 'mean': total / count if count else 0.0}
+                      for name, (_, count, total, longest) in self._timers.items()}
+            counters = dict(self._counters)
+        collected_counters, gauges = self.collected()
+        return {'timers': timers, 'counters': {**counters, **collected_counters}, 'gauges': gauges}
+
+    def prometheus(self) -> str:
+        """Returns all metrics in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            timers = [(name, list(buckets), count, total) for name, (buckets, count, total, _) in self._timers.items()]
+            counters = list(self._counters.items())
+        collected_counters, gauges = self.collected()
+        counters += collected_counters.items()
+        for name, buckets, count, total in sorted(timers):
+            metric = f'{self.prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), buckets):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum {total}')
+            lines.append(f'{metric}_count {count}')
+        for name, value in sorted(counters):
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        for name, value in sorted(gauges.items()):
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self, level: int = logging.INFO):
+        """Logs one line per timer and all counters."""
+        snapshot = self.snapshot()
+        for name, timer in sorted(snapshot['timers'].items()):
+            log.log(level, '%s: %d runs, mean %.1f ms, max %.1f ms',
+                    name, timer['count'], timer['mean'] * 1000, timer['max'] * 1000)
+        if snapshot['counters']:
+            log.log(level, 'counters: %s', ', '.join(f'{k}={v}' for k, v in sorted(snapshot['counters'].items())))
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+
+# default registry used by the app and the indicator
+metrics = Metrics()
+
+
+@contextmanager
+def profile(name: str, profiler: str = None):
+    """Profiles the block and logs the report, if profiler (default: TRADEVIEW_PROFILE env variable)
+     is 'cprofile' or 'pyinstrument'. Does nothing, if it is not set."""
+    profiler = (profiler if profiler is not None else os.environ.get(PROFILE_ENV, '')).lower()
+    if not profiler:
+        yield
+        return
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError(f'{PROFILE_ENV}=pyinstrument needs pyinstrument package installed')
+        instrument = Profiler()
+        instrument.start()
+        try:
+            yield
+        finally:
+            instrument.stop()
+            log.info('profile of %s:\n%s', name, instrument.output_text())
+    elif profiler == 'cprofile':
+        c_profile = cProfile.Profile()
+        c_profile.enable()
+        try:
+            yield
+        finally:
+            c_profile.disable()
+            report = io.StringIO()
+            pstats.Stats(c_profile, stream=report).sort_stats('cumulative').print_stats(25)
+            log.info('profile of %s:\n%s', name, report.getvalue())
+    else:
+        raise ValueError(f'unknown profiler {profiler!r} in {PROFILE_ENV}, use cprofile or pyinstrument')
+
+
+def register_endpoint(server, registry: Metrics = metrics, path: str = '/metrics',
+                      timed_path: str = '/_dash-update-component'):
+    """Adds Prometheus scrape endpoint to Flask server (app.server of Dash).
+     Also times whole requests to timed_path as stage 'request', that is callback plus JSON serialization."""
+    import flask
+
+    def export():
+        return registry.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    def start_timer():
+        if flask.request.path == timed_path:
+            flask.g.metrics_start = time.perf_counter()
+
+    def stop_timer(response):
+        start = flask.g.pop('metrics_start', None)
+        if start is not None:
+            registry.observe('request', time.perf_counter() - start)
+            registry.incr('requests')
+        return response
+
+    server.add_url_rule(path, 'metrics', export)
+    server.before_request(start_timer)
+    server.after_request(stop_timer)
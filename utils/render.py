@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def box_polygons(dates, x0, x1, y0, y1):
+    """Returns x, y arrays of closed box outlines, separated by gaps, to draw many boxes as one filled trace."""
+    count = len(x0)
+    left, right = dates[x0], dates[x1]
+    xs = np.empty(count * 6, dtype=object)
+    ys = np.empty(count * 6, dtype=np.float64)
+    for offset, x, y in ((0, left, y0), (1, right, y0), (2, right, y1), (3, left, y1), (4, left, y0)):
+        xs[offset::6] = x
+        ys[offset::6] = y
+    xs[5::6] = None
+    ys[5::6] = np.nan
+    return xs, ys
+
+
+def line_segments(dates, x0, x1, y0, y1):
+    """Returns x, y arrays of line segments, separated by gaps, to draw many lines as one trace."""
+    count = len(x0)
+    xs = np.empty(count * 3, dtype=object)
+    ys = np.empty(count * 3, dtype=np.float64)
+    xs[0::3], xs[1::3], xs[2::3] = dates[x0], dates[x1], None
+    ys[0::3], ys[1::3], ys[2::3] = y0, y1, np.nan
+    return xs, ys
+
+
+def shape_traces(result, dates) -> list:
+    """Packs shapes of IndicatorResult into one go.Scatter per style, instead of one layout shape per element.
+     Boxes become gap-separated filled polygons, lines - gap-separated segments.
+     Traces go in order of the first shape of each style, so boxes stay under lines."""
+    import plotly.graph_objects as go
+    dates = np.asarray(dates)
+    style_ids, first_shapes = np.unique(result.style, return_index=True)
+    traces = []
+    for style_id in style_ids[np.argsort(first_shapes)]:
+        mask = result.style == style_id
+        kind, color, width = result.styles[style_id][:3]
+        if kind == 'box':
+            xs, ys = box_polygons(dates, result.x0[mask], result.x1[mask], result.y0[mask], result.y1[mask])
+            traces.append(go.Scatter(
+                x=xs, y=ys, mode='lines', fill='toself', fillcolor=color,
+                line={'width': width, 'color': color},
+                hoverinfo='skip', showlegend=False,
+            ))
+        else:
+            xs, ys = line_segments(dates, result.x0[mask], result.x1[mask], result.y0[mask], result.y1[mask])
+            traces.append(go.Scatter(
+                x=xs, y=ys, mode='lines',
+                line={'width': width, 'color': color},
+                hoverinfo='skip', showlegend=False,
+            ))
+    return traces
+
+
+def shapes(result, dates) -> list:
+    """Returns list of plotly layout shape dicts of IndicatorResult, the same as Box.shape/Line.shape give."""
+    dates = np.asarray(dates)
+    shape_dicts = []
+    for x0, x1, y0, y1, style_id in zip(dates[result.x0], dates[result.x1], result.y0, result.y1, result.style):
+        kind, color, width, xref, yref = result.styles[style_id]
+        if kind == 'box':
+            shape_dicts.append({
+                'x0': x0, 'x1': x1,
+                'y0': y0, 'y1': y1,
+                'xref': xref, 'yref': yref,
+                'line_width': width,
+                'fillcolor': color,
+            })
+        else:
+            shape_dicts.append({
+                'type': 'line',
+                'x0': x0, 'x1': x1,
+                'y0': y0, 'y1': y1,
+                'xref': xref, 'yref': yref,
+                'line': {
+                    'color': color,
+                    'width': width,
+                }
+            })
+    return shape_dicts
+
+
+def render(figure, result, dates, mode: str = 'shapes'):
+    """Applies IndicatorResult to figure, that has candlestick as the first trace.
+     mode='shapes' adds plotly layout shape per element,
+     mode='traces' packs elements into few scatter traces, that is much faster on long histories."""
+    if result.candle_colour is not None:
+        figure.data[0].increasing.fillcolor = result.candle_colour
+    if mode == 'traces':
+        figure.add_traces(shape_traces(result, dates))
+    else:
+        figure.update_layout(shapes=[*figure.layout.shapes, *shapes(result, dates)])
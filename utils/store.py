@@ -0,0 +1,195 @@
+"""Persistent store of kernel results per symbol and parameters: append-only files of fixed size records,
+memory-mapped on read, and pickled checkpoint of kernel state. When source gets new bars, only they are computed,
+so after restart the first chart costs opening a few files, whatever long the history is.
+Layout: <root>/<symbol>/<parameters>/{boxes,mitigations,lines,candles}.bin and checkpoint.pkl."""
+import hashlib
+import os
+import pickle
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import numpy as np
+
+from utils import kernel
+from utils.indicator import IndicatorResult
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+# bump, when record layouts or kernel state change, to rebuild stores written by older code
+STORE_VERSION = 2
+TABLES = {
+    # order blocks with bar, where they were created, SHORT_BOX or LONG_BOX side, left bar, bottom and top
+    'boxes': np.dtype([('bar', '<i4'), ('side', 'u1'), ('x0', '<i4'), ('y0', '<f8'), ('y1', '<f8')]),
+    # box number (row of boxes) and bar, where price mitigated it
+    'mitigations': np.dtype([('box', '<i4'), ('bar', '<i4')]),
+    # BOS lines, style is BEARISH_BOS or BULLISH_BOS
+    'lines': np.dtype([('x0', '<i4'), ('x1', '<i4'), ('y', '<f8'), ('style', 'u1')]),
+    # per bar candle colouring
+    'candles': np.dtype([('colour_mode', 'u1'), ('bos_candle', '?')]),
+}
+# kernel event -> (table, field)
+EVENT_FIELDS = {
+    'box_bar': ('boxes', 'bar'),
+    'box_side': ('boxes', 'side'),
+    'box_x0': ('boxes', 'x0'),
+    'box_y0': ('boxes', 'y0'),
+    'box_y1': ('boxes', 'y1'),
+    'mitigated_box': ('mitigations', 'box'),
+    'mitigated_bar': ('mitigations', 'bar'),
+    'line_x0': ('lines', 'x0'),
+    'line_x1': ('lines', 'x1'),
+    'line_y': ('lines', 'y'),
+    'line_style': ('lines', 'style'),
+    'candle_colour_mode': ('candles', 'colour_mode'),
+    'bos_candle': ('candles', 'bos_candle'),
+}
+
+
+def _safe_name(name: str) -> str:
+    return ''.join(char if char.isalnum() or char in '-_' else '_' for char in name)
+
+
+class ResultStore:
+    """Keeps kernel results of (symbol, candle_range, extras, skip_oldest_box) on disk and brings them
+     up to date with source by computing only bars, that were appended since the last update.
+     If source history was changed or shortened, results are rebuilt from scratch."""
+    def __init__(self, root: str = 'data/.results'):
+        self.root = root
+        self._lock = Lock()
+
+    def directory(self, symbol: str, candle_range: int, extras=(), skip_oldest_box: bool = True) -> str:
+        parameters = '-'.join((str(candle_range), *sorted(extras), 'skip' if skip_oldest_box else 'all'))
+        return os.path.join(self.root, _safe_name(symbol), _safe_name(parameters))
+
+    def update(self, symbol: str, data, candle_range: int, extras=(), skip_oldest_box: bool = True,
+               fingerprint: str = None, stats: dict = None) -> IndicatorResult:
+        """Returns results over all bars of data (dataframe, Dataset or dict of arrays), computing only new bars.
+         fingerprint of source version (like Dataset.fingerprint) lets unchanged source skip history check.
+         stats dict, if given, gets bars_processed, boxes_created, boxes_removed and seconds of this computation."""
+        directory = self.directory(symbol, candle_range, extras, skip_oldest_box)
+        os.makedirs(directory, exist_ok=True)
+        size = len(data['close'])
+        with self._locked(directory):
+            checkpoint = self._load_checkpoint(directory)
+            if checkpoint is not None and not self._matches(checkpoint, data, fingerprint):
+                checkpoint = None
+            state = checkpoint['state'] if checkpoint else None
+            lengths = checkpoint['lengths'] if checkpoint else dict.fromkeys(TABLES, 0)
+            # drop records appended by interrupted update after the checkpoint
+            self._truncate(directory, lengths)
+            if stats is not None:
+                stats.update(bars_processed=0, boxes_created=0, boxes_removed=0, seconds=0.0)
+            if state is None or state.bars != size:
+                started = time.perf_counter()
+                bars = state.bars if state else 0
+                events, state = kernel.run(data, candle_range, extras, skip_oldest_box, state)
+                if stats is not None:
+                    stats.update(bars_processed=state.bars - bars, boxes_created=len(events['box_bar']),
+                                 boxes_removed=len(events['mitigated_box']), seconds=time.perf_counter() - started)
+                lengths = self._append(directory, events, lengths)
+                self._save_checkpoint(directory, {
+                    'version': STORE_VERSION,
+                    'state': state,
+                    'lengths': lengths,
+                    'fingerprint': fingerprint,
+                    'digest': self._history_digest(data, size),
+                })
+            events = self._read(directory, lengths)
+            # result would keep these as views of candles.bin, that a rebuild by other process may truncate
+            # after the lock is released, and reading them then crashes with SIGBUS
+            for event in ('candle_colour_mode', 'bos_candle'):
+                events[event] = np.array(events[event])
+            return kernel.result_from_events(events, state)
+
+    def _matches(self, checkpoint: dict, data, fingerprint) -> bool:
+        """Returns True, if data has the same bars, that checkpoint was computed over, and maybe new ones."""
+        bars = checkpoint['state'].bars
+        if fingerprint is not None and fingerprint == checkpoint['fingerprint'] and bars == len(data['close']):
+            return True
+        return bars <= len(data['close']) and checkpoint['digest'] == self._history_digest(data, bars)
+
+    @staticmethod
+    def _history_digest(data, bars: int) -> str:
+        """Returns digest of dates and prices of all the first bars, so correction of any past bar is noticed.
+         Memory-mapped columns are hashed in place, at about the speed of reading them."""
+        digest = hashlib.blake2b(str(bars).encode(), digest_size=16)
+        if 'timestamp' in data:
+            digest.update(np.ascontiguousarray(data['timestamp'][:bars], dtype='datetime64[ns]').view(np.int64))
+        else:
+            dates = np.asarray(data['date'])[:bars]
+            digest.update(np.ascontiguousarray(dates if dates.dtype.kind == 'U' else dates.astype(str)))
+        for column in ('open', 'high', 'low', 'close'):
+            digest.update(np.ascontiguousarray(data[column][:bars], dtype=np.float64))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _load_checkpoint(directory: str):
+        try:
+            with open(os.path.join(directory, 'checkpoint.pkl'), 'rb') as file:
+                checkpoint = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        if checkpoint.get('version') != STORE_VERSION:
+            return None
+        for table, dtype in TABLES.items():
+            path = os.path.join(directory, f'{table}.bin')
+            if not os.path.exists(path) or os.path.getsize(path) < checkpoint['lengths'][table] * dtype.itemsize:
+                return None
+        return checkpoint
+
+    @staticmethod
+    def _save_checkpoint(directory: str, checkpoint: dict):
+        # written aside and moved in place, so it always matches fully written records
+        path = os.path.join(directory, 'checkpoint.pkl')
+        with open(f'{path}.tmp', 'wb') as file:
+            pickle.dump(checkpoint, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def _truncate(directory: str, lengths: dict):
+        for table, dtype in TABLES.items():
+            with open(os.path.join(directory, f'{table}.bin'), 'ab') as file:
+                file.truncate(lengths[table] * dtype.itemsize)
+
+    @staticmethod
+    def _append(directory: str, events: dict, lengths: dict) -> dict:
+        """Appends new records of events to table files and returns new lengths of tables."""
+        lengths = dict(lengths)
+        for table, dtype in TABLES.items():
+            fields = {field: event for event, (event_table, field) in EVENT_FIELDS.items() if event_table == table}
+            records = np.empty(len(events[next(iter(fields.values()))]), dtype=dtype)
+            for field, event in fields.items():
+                records[field] = events[event]
+            with open(os.path.join(directory, f'{table}.bin'), 'ab') as file:
+                records.tofile(file)
+            lengths[table] += len(records)
+        return lengths
+
+    @staticmethod
+    def _read(directory: str, lengths: dict) -> dict:
+        """Returns events of all stored bars as memory-mapped columns."""
+        tables = {}
+        for table, dtype in TABLES.items():
+            if lengths[table]:
+                tables[table] = np.memmap(os.path.join(directory, f'{table}.bin'), dtype, 'r', shape=(lengths[table],))
+            else:
+                tables[table] = np.empty(0, dtype=dtype)
+        return {event: tables[table][field] for event, (table, field) in EVENT_FIELDS.items()}
+
+    @contextmanager
+    def _locked(self, directory: str):
+        """Serializes updates of one store directory between threads, and between processes where fcntl exists."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
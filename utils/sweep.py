@@ -0,0 +1,149 @@
+"""Parameter sweep of CustomTradeIndicator over candle_range values on all cores.
+Usage:
+    python -m utils.sweep data/ohlcv.csv --range 5 100 --workers 8 --output sweep.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from utils.builtins import ShapeStore, timestamps_of
+from utils.datasets import normalize_columns
+from utils.indicator import CustomTradeIndicator
+
+DEFAULT_EXTRAS = ('showPD', 'showBearishBOS', 'showBullishBOS')
+STATS_COLUMNS = ('dataset', 'candle_range', 'bars', 'order_blocks', 'short_boxes', 'long_boxes', 'bos_lines',
+                 'seconds')
+
+
+def indicator_stats(dataframe, candle_range: int, extras=DEFAULT_EXTRAS) -> dict:
+    """Runs indicator headless over all bars and returns counts of its shapes and computation time."""
+    started = time.perf_counter()
+    indicator = CustomTradeIndicator(None, dataframe)
+    indicator.compute(candle_range, list(extras))
+    seconds = time.perf_counter() - started
+    return {
+        'candle_range': candle_range,
+        'bars': indicator.tv.last_idx + 1,
+        'order_blocks': int(np.count_nonzero(indicator.tv.shape_store.columns()['kind'] == ShapeStore.BOX)),
+        'short_boxes': len(indicator.short_boxes),
+        'long_boxes': len(indicator.long_boxes),
+        'bos_lines': len(indicator.bos_lines),
+        'seconds': seconds,
+    }
+
+
+class SharedColumns:
+    """Dataset columns copied once into shared memory blocks. Workers attach them by name,
+     instead of receiving pickled copy of dataset with every task. Dates are also shared parsed,
+     as datetime64 'timestamp' column, so tasks don't parse them again."""
+    def __init__(self, dataframe, columns=('date', 'open', 'high', 'low', 'close')):
+        self.blocks = []
+        self.spec = {}
+        arrays = {column: np.asarray(dataframe[column]) for column in columns}
+        arrays['timestamp'] = timestamps_of(dataframe)
+        for column, values in arrays.items():
+            if values.dtype == object:
+                values = values.astype(str)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            self.blocks.append(block)
+            self.spec[column] = (block.name, values.dtype.str, len(values))
+
+    @staticmethod
+    def attach(spec: dict):
+        """Returns (columns, blocks) of shared dataset. Keep blocks referenced while columns are used."""
+        columns = {}
+        blocks = []
+        for column, (name, dtype, length) in spec.items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            columns[column] = np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf)
+        return columns, blocks
+
+    def close(self):
+        """Frees shared memory. Call it after all workers are done."""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# datasets attached by worker process, index -> columns
+_worker_datasets = {}
+_worker_blocks = []
+
+
+def _init_worker(specs: list):
+    for index, spec in enumerate(specs):
+        columns, blocks = SharedColumns.attach(spec)
+        _worker_datasets[index] = columns
+        _worker_blocks.extend(blocks)
+
+
+def _run_task(dataset_index: int, candle_range: int, extras):
+    return dataset_index, indicator_stats(_worker_datasets[dataset_index], candle_range, extras)
+
+
+def sweep(datasets: dict, candle_ranges, extras=DEFAULT_EXTRAS, workers: int = None, progress=None) -> list:
+    """Runs indicator for every dataset (name -> dataframe) and candle_range on process pool.
+     Returns list of stats dicts, sorted by dataset and candle_range.
+     progress(done, total) is called after each finished configuration."""
+    names = list(datasets)
+    shared = [SharedColumns(datasets[name]) for name in names]
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=([columns.spec for columns in shared],)) as executor:
+            futures = [executor.submit(_run_task, index, candle_range, tuple(extras))
+                       for index in range(len(names)) for candle_range in candle_ranges]
+            results = []
+            for done, future in enumerate(as_completed(futures), 1):
+                index, stats = future.result()
+                results.append({'dataset': names[index], **stats})
+                if progress:
+                    progress(done, len(futures))
+    finally:
+        for columns in shared:
+            columns.close()
+    return sorted(results, key=lambda stats: (names.index(stats['dataset']), stats['candle_range']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep indicator candle_range over OHLCV csv files.')
+    parser.add_argument('datasets', nargs='+', help='OHLCV csv files')
+    parser.add_argument('--range', nargs=2, type=int, default=(5, 100), metavar=('FROM', 'TO'),
+                        help='candle_range values, both ends included (default: 5 100)')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--extras', nargs='*', default=list(DEFAULT_EXTRAS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help='write results to this csv file instead of stdout')
+    args = parser.parse_args(argv)
+
+    datasets = {path: normalize_columns(pd.read_csv(path)) for path in args.datasets}
+    candle_ranges = range(args.range[0], args.range[1] + 1, args.step)
+    started = time.perf_counter()
+    results = sweep(datasets, candle_ranges, args.extras, args.workers,
+                    progress=lambda done, total: print(f'\r{done}/{total}', end='', file=sys.stderr))
+    print(f'\r{len(results)} configurations in {time.perf_counter() - started:.2f}s', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            write_csv(file, results)
+    else:
+        write_csv(sys.stdout, results)
+
+
+def write_csv(file, results: list):
+    writer = csv.DictWriter(file, STATS_COLUMNS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Viewport of the chart: bars inside zoomed x-range, OHLC downsampling to screen width,
+and lookup of shapes, that intersect the range. Keeps figure payload bounded by screen size, not history length."""
+import numpy as np
+
+# about the chart width in pixels, more candles than that are not distinguishable
+MAX_CANDLES = 1500
+
+
+def relayout_range(relayout_data, previous=None):
+    """Returns x-range [left, right] after Graph relayout event, given the range before it.
+     relayoutData holds only changed keys: resize or y-axis zoom keep previous range, dragging one end of x-axis
+     changes only that end. None range is the whole history, None end is the history edge.
+     Only autorange (double click, reset axes) goes back to the whole history."""
+    relayout_data = relayout_data or {}
+    if relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range' in relayout_data:
+        return list(relayout_data['xaxis.range'][:2])
+    left, right = previous or (None, None)
+    left = relayout_data.get('xaxis.range[0]', left)
+    right = relayout_data.get('xaxis.range[1]', right)
+    if left is None and right is None:
+        return None
+    return [left, right]
+
+
+def visible_range(x_range, timestamps) -> tuple:
+    """Returns (start, stop) bar indices of x-range [left, right] of relayout_range(), with one bar margin
+     on each side. Whole history if there is no range or it has no bars."""
+    size = len(timestamps)
+    if x_range is None:
+        return 0, size
+    import pandas as pd
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    left, right = x_range
+    start = 0 if left is None else int(np.searchsorted(
+        timestamps, pd.Timestamp(left).to_datetime64().astype('datetime64[ns]'), 'left'))
+    stop = size if right is None else int(np.searchsorted(
+        timestamps, pd.Timestamp(right).to_datetime64().astype('datetime64[ns]'), 'right'))
+    if stop == 0 or start == size:
+        # range is out of data, e.g. left from previous source
+        return 0, size
+    return max(0, start - 1), min(size, stop + 1)
+
+
+def downsample_ohlc(open_, high, low, close, start: int, stop: int, max_candles: int = MAX_CANDLES) -> tuple:
+    """Returns (first bar indices, open, high, low, close) of bars start...stop-1 merged into at most
+     max_candles candles: open of the first bar, high/low extremes and close of the last bar of each group."""
+    count = stop - start
+    if count <= max_candles:
+        return (np.arange(start, stop), open_[start:stop], high[start:stop], low[start:stop], close[start:stop])
+    group = -(-count // max_candles)
+    firsts = np.arange(start, stop, group)
+    lasts = np.minimum(firsts + group, stop) - 1
+    return (firsts, np.asarray(open_)[firsts],
+            np.maximum.reduceat(high[start:stop], firsts - start),
+            np.minimum.reduceat(low[start:stop], firsts - start),
+            np.asarray(close)[lasts])
+
+
+class ShapeIndex:
+    """Interval index of IndicatorResult shapes over bar axis. Shapes are grouped by length class c
+     (length below 2 ** c bars) and sorted by left edge in each group. Shape of group c, that intersects the range,
+     starts at most 2 ** c bars before it, so every group is looked up by binary search of both range ends and
+     only shapes in between are checked by right edge. Long boxes don't make lookup of short lines slower."""
+    def __init__(self, result, stats: dict = None):
+        self.result = result
+        # counters of computation, that produced result (see ResultStore.update)
+        self.stats = stats or {}
+        lengths = np.maximum(result.x1.astype(np.int64) - result.x0 + 1, 1)
+        classes = np.frexp(lengths.astype(np.float64))[1]
+        self._rows = np.lexsort((result.x0, classes))
+        self._x0 = result.x0[self._rows]
+        self._x1 = result.x1[self._rows]
+        classes = classes[self._rows]
+        firsts = np.flatnonzero(np.diff(classes, prepend=-1))
+        self._groups = [(int(classes[first]), int(first), int(last))
+                        for first, last in zip(firsts, [*firsts[1:], len(classes)])]
+
+    def __len__(self):
+        return len(self.result)
+
+    def query(self, start: int, stop: int):
+        """Returns IndicatorResult with only shapes, that intersect bars start...stop-1, in drawing order."""
+        rows = [np.empty(0, dtype=np.int64)]
+        for length_class, first, last in self._groups:
+            x0 = self._x0[first:last]
+            low = first + np.searchsorted(x0, start - 2 ** length_class + 1, 'left')
+            high = first + np.searchsorted(x0, stop - 1, 'right')
+            rows.append(self._rows[low:high][self._x1[low:high] >= start])
+        return self.result.take(np.sort(np.concatenate(rows)))